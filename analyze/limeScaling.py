@@ -0,0 +1,223 @@
+import re
+import itertools
+import csv
+import sys
+import json
+import pathlib
+import argparse
+
+import numpy as np
+
+
+def threadsForPath(csvFilePath):
+    """returns the thread count in names like execT_6_threads.csv"""
+    match = re.search(r"execT_(\d+)_threads", pathlib.Path(csvFilePath).name)
+    if match is None:
+        raise ValueError(f"No thread count in file name {csvFilePath}.")
+    return int(match.group(1))
+
+
+def readExecTimes(csvFilePaths):
+    """reads execT_*_threads.csv files as written by tests.executionTimeTest.
+    returns arrays of blocks, threads and LIME times of successful runs"""
+    nBlocks = []
+    nThreads = []
+    execT = []
+    for csvFilePath in csvFilePaths:
+        threads = threadsForPath(csvFilePath)
+        with open(str(csvFilePath), "r") as csvFile:
+            for row in csv.DictReader(csvFile):
+                if row["success"] != "True":
+                    continue
+                nBlocks.append(int(row["nBlocks"]))
+                nThreads.append(threads)
+                execT.append(float(row["execT"]))
+    return np.array(nBlocks), np.array(nThreads), np.array(execT)
+
+
+class ScalingModel:
+    """Amdahl model of LIME run times,
+    t = overhead + nBlocks * (serialT + parallelT / nThreads)
+    where serialT and parallelT are the seconds per block spent in the
+    serial and parallel part of a run. convert/limeScheduler.py plans jobs
+    with it"""
+
+    def __init__(self, overhead, serialT, parallelT, pointsPerBlock=512):
+        self.overhead = overhead
+        self.serialT = serialT
+        self.parallelT = parallelT
+        self.pointsPerBlock = pointsPerBlock
+
+    def time(self, nBlocks, nThreads):
+        return self.overhead + nBlocks * (self.serialT + self.parallelT / nThreads)
+
+    def serialFraction(self):
+        return self.serialT / (self.serialT + self.parallelT)
+
+    def speedup(self, nThreads):
+        """returns the speedup of the per block time over a single thread"""
+        s = self.serialFraction()
+        return 1 / (s + (1 - s) / nThreads)
+
+    def efficiency(self, nThreads):
+        return self.speedup(nThreads) / nThreads
+
+    def maxBlocks(self, seconds, nThreads):
+        """returns the most blocks finishing within seconds on nThreads"""
+        return max(
+            0,
+            int((seconds - self.overhead) / (self.serialT + self.parallelT / nThreads)),
+        )
+
+    def maxPoints(self, seconds, nThreads):
+        return self.maxBlocks(seconds, nThreads) * self.pointsPerBlock
+
+    def saturationThreads(self, minGain=0.05, maxThreads=4096):
+        """returns the thread count past which one more thread speeds runs up
+        by less than the fraction minGain"""
+        for nThreads in range(1, maxThreads):
+            if self.speedup(nThreads + 1) / self.speedup(nThreads) - 1 < minGain:
+                return nThreads
+        return maxThreads
+
+    def toDict(self):
+        return {
+            "overhead": self.overhead,
+            "serialT": self.serialT,
+            "parallelT": self.parallelT,
+            "pointsPerBlock": self.pointsPerBlock,
+        }
+
+    def save(self, path):
+        with open(path, "w") as modelFile:
+            json.dump(self.toDict(), modelFile, indent=2)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as modelFile:
+            return cls(**json.load(modelFile))
+
+
+def nonNegativeLeastSquares(design, values):
+    """returns the non-negative coefficients minimizing the squared residuals
+    of design @ coefficients - values. Every subset of the few columns of
+    design is fitted by least squares, the best fit without negative
+    coefficients is kept"""
+    best = np.zeros(design.shape[1])
+    bestResidual = np.sum(values**2)
+    nColumns = design.shape[1]
+    for size in range(1, nColumns + 1):
+        for columns in itertools.combinations(range(nColumns), size):
+            columns = list(columns)
+            fitted, *_ = np.linalg.lstsq(design[:, columns], values, rcond=None)
+            if np.any(fitted < 0):
+                continue
+            coefficients = np.zeros(nColumns)
+            coefficients[columns] = fitted
+            residual = np.sum((values - design @ coefficients) ** 2)
+            if residual < bestResidual:
+                best, bestResidual = coefficients, residual
+    return best
+
+
+def fitScalingModel(nBlocks, nThreads, execT, pointsPerBlock=512):
+    """fits a ScalingModel to run times by non-negative least squares.
+    returns the model and the coefficient of determination"""
+    design = np.stack(
+        [np.ones(len(nBlocks)), nBlocks, nBlocks / nThreads], axis=1
+    ).astype(float)
+    coefficients = nonNegativeLeastSquares(design, execT)
+    residuals = execT - design @ coefficients
+    rSquared = 1 - np.sum(residuals**2) / np.sum((execT - np.mean(execT)) ** 2)
+    return ScalingModel(*coefficients, pointsPerBlock=pointsPerBlock), rSquared
+
+
+def plotScalingModel(model, nBlocks, nThreads, execT, path):
+    from matplotlib import pyplot as plt
+
+    fig, ax = plt.subplots()
+    xFit = np.linspace(0, np.max(nBlocks), 50)
+    for threads in np.unique(nThreads):
+        measured = nThreads == threads
+        line = ax.plot(nBlocks[measured], execT[measured], linestyle="", marker=".")
+        ax.plot(
+            xFit,
+            model.time(xFit, threads),
+            "-",
+            linewidth=1,
+            color=line[0].get_color(),
+            label=f"{threads} Thread{'s' if threads > 1 else ''}",
+        )
+    ax.set_xlabel("Number of Blocks")
+    ax.set_ylabel("Elapsed time [s]")
+    plt.legend()
+    plt.savefig(str(path), bbox_inches="tight")
+
+
+def createScalingArgumentParser():
+    arg_parser = argparse.ArgumentParser(
+        description="Fits an Amdahl model to LIME run times and answers "
+        "planning questions with it."
+    )
+    arg_parser.add_argument(
+        "csvFiles",
+        metavar="CSV file",
+        type=str,
+        nargs="+",
+        help="execT_<threads>_threads.csv files of executionTimeTest",
+    )
+    arg_parser.add_argument(
+        "--hours", type=float, help="Time budget of a run, defaults to 2"
+    )
+    arg_parser.add_argument(
+        "-t", "--threads", type=int, help="Threads of a run, defaults to 16"
+    )
+    arg_parser.add_argument(
+        "--mingain",
+        type=float,
+        help="Speedup of one more thread below which cores stop helping, "
+        "defaults to 0.05",
+    )
+    arg_parser.add_argument(
+        "--pointsperblock", type=int, help="Gridpoints per block, defaults to 512"
+    )
+    arg_parser.add_argument("--save", metavar="PATH", help="Write the model as json")
+    arg_parser.add_argument("--plot", metavar="PATH", help="Plot measured and fit")
+
+    return arg_parser
+
+
+if __name__ == "__main__":
+    argParser = createScalingArgumentParser()
+    if len(sys.argv) < 2:
+        argParser.print_help()
+        exit()
+    args = argParser.parse_args()
+
+    hours = args.hours if args.hours is not None else 2
+    threads = args.threads if args.threads is not None else 16
+    minGain = args.mingain if args.mingain is not None else 0.05
+    pointsPerBlock = args.pointsperblock if args.pointsperblock is not None else 512
+
+    nBlocks, nThreads, execT = readExecTimes(args.csvFiles)
+    model, rSquared = fitScalingModel(nBlocks, nThreads, execT, pointsPerBlock)
+
+    print(f"fit of {len(execT)} runs, R^2 = {rSquared:.4f}")
+    print(f"overhead per run:         {model.overhead:.3f} s")
+    print(f"serial time per block:    {model.serialT:.4f} s")
+    print(f"parallel time per block:  {model.parallelT:.4f} s")
+    print(f"serial fraction:          {model.serialFraction():.4f}")
+    print(
+        f"largest run in {hours:g} h on {threads} threads: "
+        f"{model.maxBlocks(hours * 3600, threads)} blocks, "
+        f"{model.maxPoints(hours * 3600, threads)} points"
+    )
+    print(
+        f"threads past which one more gains less than {minGain:.0%}: "
+        f"{model.saturationThreads(minGain)}"
+    )
+
+    if args.save is not None:
+        model.save(args.save)
+    if args.plot is not None:
+        plotScalingModel(model, nBlocks, nThreads, execT, args.plot)
@@ -0,0 +1,178 @@
+import os
+import sys
+import glob
+import json
+import time
+import pathlib
+import argparse
+import traceback
+import multiprocessing
+
+import h5py
+
+from convert import convertWithArgs
+from helper import addConversionArguments, outFileForFlashFile, metricsForOutFile
+from ioGate import setIoSemaphore
+
+
+def createBatchArgumentParser():
+    arg_parser = argparse.ArgumentParser(
+        description="Converts many FLASH files to LIME input concurrently. "
+        "Existing LIME files are skipped, results are recorded in a manifest.",
+    )
+    arg_parser.add_argument(
+        "outDir", metavar="LIME directory", type=str, help="Directory of LIME files"
+    )
+    arg_parser.add_argument(
+        "inputs",
+        metavar="FLASH input",
+        type=str,
+        nargs="+",
+        help="FLASH files, directories holding FLASH files or glob patterns",
+    )
+    arg_parser.add_argument(
+        "-p",
+        "--processes",
+        type=int,
+        help="Number of files converted at the same time. Defaults to the number of cores",
+    )
+    arg_parser.add_argument(
+        "--iolimit",
+        type=int,
+        help="Number of conversions reading or writing at the same time. "
+        "Defaults to --processes",
+    )
+    arg_parser.add_argument(
+        "--manifest",
+        type=str,
+        help="Path of the JSON manifest. Defaults to manifest.json in the LIME directory",
+    )
+    addConversionArguments(arg_parser)
+
+    return arg_parser
+
+
+def flashFilesForInputs(inputs):
+    """returns sorted HDF5 files of inputs, which are files, directories or
+    glob patterns"""
+    flashFiles = set()
+    for flashInput in inputs:
+        if os.path.isdir(flashInput):
+            paths = [os.path.join(flashInput, name) for name in os.listdir(flashInput)]
+        else:
+            paths = glob.glob(flashInput)
+        flashFiles.update(
+            path for path in paths if os.path.isfile(path) and h5py.is_hdf5(path)
+        )
+    return sorted(flashFiles)
+
+
+def initBatchWorker(ioSemaphore):
+    setIoSemaphore(ioSemaphore)
+
+
+def convertFile(fileArgs):
+    """converts to a temporary file that replaces the LIME file when done, so
+    existing LIME files are always complete. returns manifest entry"""
+    result = {"inFile": fileArgs.inFile, "outFile": fileArgs.outFile}
+    if os.path.exists(fileArgs.outFile):
+        return {**result, "status": "skipped"}
+
+    partialFile = f"{fileArgs.outFile}.partial"
+    start = time.time()
+    try:
+        convertWithArgs(
+            argparse.Namespace(**{**vars(fileArgs), "outFile": partialFile})
+        )
+        os.replace(partialFile, fileArgs.outFile)
+    except Exception as exception:
+        return {
+            **result,
+            "status": "failed",
+            "seconds": time.time() - start,
+            "error": repr(exception),
+            "traceback": traceback.format_exc(),
+        }
+
+    return {
+        **result,
+        "status": "converted",
+        "seconds": time.time() - start,
+        "bytes": os.path.getsize(fileArgs.outFile),
+    }
+
+
+def writeManifest(manifestPath, results, start):
+    manifest = {
+        "seconds": time.time() - start,
+        "counts": {
+            status: sum(result["status"] == status for result in results)
+            for status in ["converted", "skipped", "failed"]
+        },
+        "results": results,
+    }
+    temporaryPath = f"{manifestPath}.tmp"
+    with open(temporaryPath, "w") as manifestFile:
+        json.dump(manifest, manifestFile, indent=2)
+    os.replace(temporaryPath, manifestPath)
+
+
+def argsForFile(args, flashFilePath):
+    """returns the arguments of the serial conversion of flashFilePath"""
+    outFile = outFileForFlashFile(args.outDir, flashFilePath)
+    return argparse.Namespace(
+        **{
+            **vars(args),
+            "inFile": flashFilePath,
+            "outFile": str(outFile),
+            "workers": 1,
+            **metricsForOutFile(args, outFile),
+        }
+    )
+
+
+def convertBatchWithArgs(args):
+    """converts all FLASH files of args.inputs into args.outDir with a pool of
+    args.processes processes. Each conversion is serial (--workers and
+    --shards are not used). The manifest is rewritten after every file.
+    returns list of manifest entries"""
+    if args.shards:
+        raise ValueError("--shards can not be used in batch conversions.")
+    nProcesses = args.processes if args.processes is not None else os.cpu_count()
+    ioLimit = args.iolimit if args.iolimit is not None else nProcesses
+
+    pathlib.Path(args.outDir).mkdir(parents=True, exist_ok=True)
+    manifestPath = (
+        args.manifest
+        if args.manifest is not None
+        else os.path.join(args.outDir, "manifest.json")
+    )
+
+    tasks = [
+        argsForFile(args, flashFilePath)
+        for flashFilePath in flashFilesForInputs(args.inputs)
+    ]
+
+    start = time.time()
+    results = []
+    with multiprocessing.Pool(
+        nProcesses,
+        initializer=initBatchWorker,
+        initargs=(multiprocessing.Semaphore(ioLimit),),
+    ) as pool:
+        for result in pool.imap_unordered(convertFile, tasks):
+            results.append(result)
+            writeManifest(manifestPath, results, start)
+
+    return results
+
+
+if __name__ == "__main__":
+    argParser = createBatchArgumentParser()
+
+    if len(sys.argv) < 2:
+        argParser.print_help()
+        exit()
+
+    for result in convertBatchWithArgs(argParser.parse_args()):
+        print(f"{result['status']:>9} {result['inFile']}")
@@ -0,0 +1,259 @@
+import os
+import csv
+import sys
+import json
+import math
+import pathlib
+import argparse
+import subprocess
+
+import h5py
+import numpy as np
+
+from syntheticFlash import writeSyntheticFlashFile, allFields
+
+convertScript = pathlib.Path(__file__).parent.absolute() / "convert.py"
+
+resultColumns = [
+    "label",
+    "leaves",
+    "depth",
+    "blockShape",
+    "converterArgs",
+    "wallSeconds",
+    "blocksPerSecond",
+    "readMBPerSecond",
+    "writeMBPerSecond",
+    "peakMemoryMB",
+    "outputMB",
+]
+
+
+def depthForLeaves(nLeaves):
+    """returns the refinement depth used for nLeaves leaves if none is given,
+    two levels more than a fully refined tree needs"""
+    return max(4, math.ceil(math.log(max(nLeaves, 1), 8)) + 2)
+
+
+def syntheticFileForScale(workDir, nLeaves, depth, blockShape, fields=allFields):
+    """returns path of the synthetic FLASH file of the given scale and fields
+    in workDir, written on first use"""
+    shape = "x".join(str(n) for n in blockShape)
+    name = f"synthetic_{nLeaves}_{depth}_{shape}"
+    if sorted(set(fields) | {"dens"}) != sorted(allFields):
+        name += "_" + "-".join(sorted(set(fields) | {"dens"}))
+    path = pathlib.Path(workDir) / f"{name}.h5"
+    if not path.exists():
+        writeSyntheticFlashFile(
+            path, nLeaves, maxLevel=depth, blockShape=blockShape, fields=fields
+        )
+    return path
+
+
+def leafCount(flashFilePath):
+    with h5py.File(flashFilePath, "r") as flashFile:
+        return int(np.sum(flashFile["node type"][()] == 1))
+
+
+def runConversion(flashFilePath, workDir, converterArgs):
+    """converts flashFilePath in a separate process, so that its peak memory
+    is its own. returns the metrics written by the converter and the size of
+    the LIME file"""
+    outFile = pathlib.Path(workDir) / "benchmark_out.h5"
+    metricsFile = pathlib.Path(workDir) / "benchmark_metrics.json"
+    subprocess.run(
+        [
+            sys.executable,
+            str(convertScript),
+            str(flashFilePath),
+            str(outFile),
+            "--metrics",
+            str(metricsFile),
+            *converterArgs,
+        ],
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+    with open(metricsFile) as metrics:
+        return json.load(metrics), os.path.getsize(outFile)
+
+
+def benchmarkScales(
+    workDir,
+    scales,
+    depth=None,
+    blockShape=(8, 8, 8),
+    fields=allFields,
+    converterArgs=(),
+    repeat=1,
+):
+    """converts a synthetic FLASH file of fields with every number of leaves in
+    scales and returns a result dict per scale with keys resultColumns. Of repeated
+    conversions, the fastest is kept"""
+    results = []
+    for nLeaves in scales:
+        scaleDepth = depth if depth is not None else depthForLeaves(nLeaves)
+        flashFilePath = syntheticFileForScale(
+            workDir, nLeaves, scaleDepth, blockShape, fields
+        )
+
+        best = None
+        for _ in range(repeat):
+            metrics, outputSize = runConversion(flashFilePath, workDir, converterArgs)
+            if best is None or metrics["wallSeconds"] < best[0]["wallSeconds"]:
+                best = (metrics, outputSize)
+        metrics, outputSize = best
+
+        # stages run in worker processes are not recorded, their blocks are
+        # taken to be all leaves
+        emptyStage = {"blocks": 0, "bytes": 0}
+        read = metrics["stages"].get("read", emptyStage)
+        write = metrics["stages"].get("write", emptyStage)
+        nBlocks = write["blocks"] or leafCount(flashFilePath)
+        wallSeconds = metrics["wallSeconds"]
+        results.append(
+            {
+                "leaves": nLeaves,
+                "depth": scaleDepth,
+                "blockShape": "x".join(str(n) for n in blockShape),
+                "converterArgs": " ".join(converterArgs),
+                "wallSeconds": wallSeconds,
+                "blocksPerSecond": nBlocks / wallSeconds,
+                "readMBPerSecond": read["bytes"] / 2**20 / wallSeconds,
+                "writeMBPerSecond": write["bytes"] / 2**20 / wallSeconds,
+                "peakMemoryMB": max(
+                    metrics["peakMemoryMB"], metrics["peakWorkerMemoryMB"]
+                ),
+                "outputMB": outputSize / 2**20,
+            }
+        )
+
+    return results
+
+
+def appendResults(resultsPath, label, results):
+    """appends results labeled label to csv file resultsPath"""
+    newFile = not pathlib.Path(resultsPath).exists()
+    with open(resultsPath, "a", newline="") as resultsFile:
+        writer = csv.DictWriter(resultsFile, fieldnames=resultColumns)
+        if newFile:
+            writer.writeheader()
+        for result in results:
+            writer.writerow({"label": label, **result})
+
+
+def readResults(resultsPath):
+    with open(resultsPath, newline="") as resultsFile:
+        return list(csv.DictReader(resultsFile))
+
+
+def compareResults(results, reference):
+    """returns list of (leaves, blocks/s of results over blocks/s of the last
+    reference row converting the same synthetic file)"""
+    referenceRates = {
+        (row["leaves"], row["depth"], row["blockShape"]): float(row["blocksPerSecond"])
+        for row in reference
+    }
+    comparison = []
+    for result in results:
+        key = (str(result["leaves"]), str(result["depth"]), result["blockShape"])
+        if key in referenceRates:
+            comparison.append(
+                (result["leaves"], result["blocksPerSecond"] / referenceRates[key])
+            )
+    return comparison
+
+
+def createBenchmarkArgumentParser():
+    arg_parser = argparse.ArgumentParser(
+        description="Times conversions of synthetic FLASH files at several "
+        "scales. Arguments not listed here are passed to the converter.",
+    )
+    arg_parser.add_argument(
+        "workDir",
+        metavar="work directory",
+        type=str,
+        help="Directory for synthetic FLASH files and LIME output",
+    )
+    arg_parser.add_argument(
+        "--scales",
+        type=int,
+        nargs="+",
+        help="Leaf counts to convert, defaults to 512 4096 32768",
+    )
+    arg_parser.add_argument(
+        "-d", "--depth", type=int, help="Refinement levels of the synthetic files"
+    )
+    arg_parser.add_argument(
+        "--blockshape",
+        type=int,
+        nargs=3,
+        metavar=("NX", "NY", "NZ"),
+        help="Cells per block, defaults to 8 8 8. Blocks must be cubic",
+    )
+    arg_parser.add_argument(
+        "--fields",
+        nargs="+",
+        choices=allFields,
+        help="Unknowns of the synthetic files, defaults to all. dens is always "
+        "written",
+    )
+    arg_parser.add_argument(
+        "--repeat", type=int, help="Conversions per scale, the fastest is kept"
+    )
+    arg_parser.add_argument(
+        "--label", type=str, help="Label of the results, e.g. a commit"
+    )
+    arg_parser.add_argument(
+        "--results",
+        type=str,
+        help="csv file the results are appended to, "
+        "defaults to benchmark.csv in the work directory",
+    )
+    arg_parser.add_argument(
+        "--compare",
+        type=str,
+        metavar="CSV",
+        help="Report blocks/s relative to the results in CSV",
+    )
+
+    return arg_parser
+
+
+if __name__ == "__main__":
+    argParser = createBenchmarkArgumentParser()
+    if len(sys.argv) < 2:
+        argParser.print_help()
+        exit()
+    args, converterArgs = argParser.parse_known_args()
+
+    results = benchmarkScales(
+        args.workDir,
+        args.scales if args.scales is not None else [512, 4096, 32768],
+        depth=args.depth,
+        blockShape=tuple(args.blockshape) if args.blockshape else (8, 8, 8),
+        fields=args.fields if args.fields is not None else allFields,
+        converterArgs=converterArgs,
+        repeat=args.repeat if args.repeat is not None else 1,
+    )
+    appendResults(
+        args.results
+        if args.results is not None
+        else pathlib.Path(args.workDir) / "benchmark.csv",
+        args.label if args.label is not None else "",
+        results,
+    )
+
+    print(
+        f"{'leaves':>8}{'wall [s]':>10}{'blocks/s':>12}{'read MB/s':>11}"
+        f"{'write MB/s':>12}{'peak MB':>10}"
+    )
+    for result in results:
+        print(
+            f"{result['leaves']:>8}{result['wallSeconds']:>10.3f}"
+            f"{result['blocksPerSecond']:>12.0f}{result['readMBPerSecond']:>11.1f}"
+            f"{result['writeMBPerSecond']:>12.1f}{result['peakMemoryMB']:>10.1f}"
+        )
+    if args.compare is not None:
+        for nLeaves, speedup in compareResults(results, readResults(args.compare)):
+            print(f"{nLeaves} leaves: {speedup:.2f}x blocks/s of {args.compare}")
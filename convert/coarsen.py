@@ -0,0 +1,35 @@
+import numpy as np
+
+
+def coarseningFactors(refineLevels, maxLevel, fullLevels, maxFactor=8):
+    """returns the factor each block edge is coarsened by. Blocks on the
+    fullLevels finest refinement levels keep factor 1, every coarser level
+    doubles the factor, up to maxFactor (one point per block)"""
+    exponents = np.clip(
+        maxLevel - fullLevels + 1 - np.asarray(refineLevels),
+        0,
+        int(np.log2(maxFactor)),
+    )
+    return 2**exponents
+
+
+def coarsenBlocks(values, factor):
+    """averages np.array of shape (nBlocks,nx,ny,nz) over cubes of factor^3
+    cells, returns np.array of shape (nBlocks,nx/factor,ny/factor,nz/factor)"""
+    if factor == 1:
+        return values
+    nBlocks, nx, ny, nz = values.shape
+    return values.reshape(
+        nBlocks, nx // factor, factor, ny // factor, factor, nz // factor, factor
+    ).mean(axis=(2, 4, 6))
+
+
+def coarseIndices(blockShape, factor):
+    """returns index grids (Ix,Iy,Iz) of the points of a block coarsened by
+    factor, in units of coarse cells. A coarse point sits at the centroid of
+    the factor^3 fine gridpoints it averages, (factor-1)/2 fine cells above
+    the lower corner of its coarse cell"""
+    offset = (factor - 1) / (2 * factor)
+    return np.meshgrid(
+        *[np.arange(nib // factor) + offset for nib in blockShape], indexing="ij"
+    )
@@ -1,15 +1,27 @@
 import sys
+import json
 import argparse
 
 import h5py
-from flashBlock import FlashFactory
-from limeFile import LimeFile
+from flashBlock import FlashFactory, BlockBatch
+from limeFile import LimeFile, progressForFile
+from flashMetadata import keyForFile
+from parallel import generateBatchesInParallel
+from shards import writeShards
+from sampling import PointSampler
+from pipeline import BlockPipeline
+from metrics import recording
+from sinks import sinkpointsForMode, sinkCountForRadius
+from derivedFields import inputsFor
 from helper import (
     centerAxis,
     sampleSphereSurface,
     radiusForBoundingboxes,
     sampleSphere,
     createArgumentParser,
+    storageForArgs,
+    regionForArgs,
+    chunkCacheForArgs,
 )
 
 
@@ -17,47 +29,271 @@ def parseArgs():
     argParser = createArgumentParser()
 
     if len(sys.argv) < 2:
-        arg_parser.print_help()
+        argParser.print_help()
         exit()
 
-    args = arg_parser.parse_args()
+    args = argParser.parse_args()
 
     return args
 
 
-def convertWithArgs(args):
-    with LimeFile(f"{str(args.outFile)}", "w") as limeFile:
-        flashFile = h5py.File(args.inFile, "r")
+# arguments changing the content of the LIME file, recorded for resuming
+outputArguments = [
+    "blocks",
+    "sinks",
+    "radscale",
+    "sinkmode",
+    "sinkseed",
+    "sinkspacing",
+    "center",
+    "columns",
+    "coarsen",
+    "sphere",
+    "box",
+    "cone",
+    "derived",
+    "pointbudget",
+    "samplefield",
+    "samplepower",
+    "storage",
+    "chunkblocks",
+    "shuffle",
+]
 
-        ff = FlashFactory(flashFile)
+# --columns choice: LimeFile property
+columnProperties = {
+    "density": "Density",
+    "gastemperature": "GasTemperature",
+    "dusttemperature": "DustTemperature",
+    "velocity": "Velocity",
+    "magfield": "Magfield",
+}
+
+# --derived choice: LimeFile property
+derivedProperties = {
+    "h2density": "H2Density",
+    "abundance": "Abundance",
+    "doppler": "Doppler",
+}
+
+# --samplefield choice: block attribute
+sampleAttributes = {
+    "density": "densities",
+    "temperature": "temperatures",
+    "dusttemperature": "dusttemperatures",
+    "densitygradient": "densitygradients",
+}
+
+
+def convertWithArgs(args, geometryFile=None, copyGeometry=False):
+    """converts args.inFile to args.outFile. If geometryFile is given, it is a
+    LIME file converted with the same arguments from a FLASH file with the
+    same mesh, its ID, position and IS_SINK columns are linked (or copied)
+    instead of written. With args.resume, an interrupted conversion of the
+    same file and arguments into args.outFile is continued. Stage metrics
+    and profiles are recorded as requested by args.metrics, args.profile and
+    args.tracemalloc"""
+    with recording(args.metrics, args.profile, args.tracemalloc):
+        convertFileWithArgs(args, geometryFile, copyGeometry)
+
+
+def convertFileWithArgs(args, geometryFile, copyGeometry):
+    if geometryFile is not None and (args.pointbudget is not None or args.shards):
+        raise ValueError(
+            "Reusing geometry needs a conversion without --pointbudget or --shards."
+        )
+    resumable = geometryFile is None and args.pointbudget is None and not args.shards
+    if args.resume and not resumable:
+        raise ValueError(
+            "--resume needs a conversion without --pointbudget, --shards "
+            "or reused geometry."
+        )
+    if args.sinkspacing is not None and args.sinks is not None:
+        raise ValueError("--sinks can not be combined with --sinkspacing")
+    if args.prefetch is not None and args.prefetch < 1:
+        raise ValueError("--prefetch needs a depth of at least 1.")
+    if args.pointbudget is not None and args.shards:
+        raise ValueError("--pointbudget can not be combined with --shards")
+    if args.samplefield == "densitygradient" and args.coarsen is not None:
+        raise ValueError("--samplefield densitygradient needs uncoarsened blocks.")
+    derived = args.derived if args.derived is not None else []
+    if derived and (args.coarsen is not None or args.pointbudget is not None):
+        raise ValueError(
+            "--derived can not be combined with --coarsen or --pointbudget."
+        )
+
+    inFileKey = list(keyForFile(args.inFile))
+    arguments = {name: getattr(args, name) for name in outputArguments}
+    progress = progressForFile(args.outFile) if args.resume else None
+    if progress is not None and (
+        json.loads(progress["IN_FILE_KEY"]) != inFileKey
+        or json.loads(progress["ARGUMENTS"]) != json.loads(json.dumps(arguments))
+    ):
+        raise ValueError(
+            f"{args.outFile} was converted from another FLASH file "
+            "or with other arguments."
+        )
+
+    columns = (
+        args.columns
+        if args.columns is not None
+        else ["density", "gastemperature", "velocity", "magfield"]
+    )
+    properties = [columnProperties[name] for name in columns] + [
+        derivedProperties[name] for name in derived
+    ]
+    # read only the FLASH fields the configured LIME columns are written from
+    attributes = LimeFile.attributesForProperties(properties)
+    if args.pointbudget is not None:
+        field = args.samplefield if args.samplefield is not None else "density"
+        attributes.append(sampleAttributes[field])
+    inputs = inputsFor(attributes)
+
+    with LimeFile(f"{str(args.outFile)}", "w" if progress is None else "a") as limeFile:
+        flashFile = h5py.File(args.inFile, "r", **chunkCacheForArgs(args))
+
+        ff = FlashFactory(
+            flashFile,
+            center=args.center,
+            fullLevels=args.coarsen,
+            region=regionForArgs(args),
+            sidecar=args.sidecar,
+            memmap=not args.nomemmap,
+            extraFields=sorted(inputs - set(BlockBatch.properties)),
+            columns=sorted(inputs & set(FlashFactory.attributeFields)),
+        )
 
         nBlocks = args.blocks if args.blocks is not None else len(ff.leaves)
         nSinks = args.sinks if args.sinks is not None else 1000
         radscale = args.radscale if args.radscale is not None else 1
+        batchSize = args.batchsize if args.batchsize is not None else 256
+        bufferSize = args.buffersize if args.buffersize is not None else 64
+        nWorkers = args.workers if args.workers is not None else 1
+        storage = storageForArgs(args)
+        nGridpoints = ff.gridpointsForSlice(slice(0, nBlocks))
+        if args.pointbudget is not None:
+            nGridpoints = min(args.pointbudget, nGridpoints)
 
         # print(ff.radius)
         # print(ff.minscale)
 
         # generate sinkpoints
-        sinkpoints = sampleSphereSurface(nSinks) * ff.radius * radscale
+        if args.sinkspacing is not None:
+            nSinks = sinkCountForRadius(
+                ff.radius * radscale, ff.minscale, args.sinkspacing
+            )
+        sinkMode = args.sinkmode if args.sinkmode is not None else "random"
+        sinkpoints = (
+            sinkpointsForMode(nSinks, sinkMode, args.sinkseed) * ff.radius * radscale
+        )
+
+        if progress is not None:
+            limeFile.reopenPoints()
+            resumeBlocksAndSinks(
+                limeFile,
+                ff,
+                progress,
+                sinkpoints,
+                batchSize,
+                bufferSize,
+                nWorkers,
+                args.prefetch,
+            )
+            return
 
         # prepare outfile
         limeFile.setupFileAttributes(radius=ff.radius * radscale, minscale=ff.minscale)
         limeFile.setupPrimaryGroups()
-        limeFile.setupPoints(nBlocks=nBlocks, nSinks=nSinks)
+
+        if args.shards:
+            # write data to shards, columns of outfile become virtual datasets
+            limeFile.setupShards(
+                writeShards(
+                    ff,
+                    args.outFile,
+                    nBlocks,
+                    sinkpoints,
+                    properties,
+                    batchSize,
+                    nWorkers,
+                    storage,
+                )
+            )
+        else:
+            limeFile.setupStorage(**storage)
+
+        if geometryFile is not None:
+            limeFile.setupLinkedPoints(
+                nBlocks, nSinks, nGridpoints, geometryFile, copy=copyGeometry
+            )
+        else:
+            limeFile.setupPoints(
+                nBlocks=nBlocks,
+                nSinks=nSinks,
+                nGridpoints=nGridpoints,
+            )
 
         # prepare properties
-        limeFile.setupDensity()
-        limeFile.setupGasTemperature()
-        limeFile.setupVelocity()
-        limeFile.setupMagfield()
+        limeFile.setupProperties(properties)
+
+        if args.shards:
+            return
+
+        if resumable:
+            limeFile.setupProgress(args.inFile, inFileKey, arguments)
 
         # write data
         allLeafSlice = slice(0, nBlocks)
-        limeFile.writeBlocks(ff.generateBlocksForSlice(allLeafSlice))
+        blocks = blocksForSlice(ff, allLeafSlice, batchSize, nWorkers, args.prefetch)
+        if args.pointbudget is not None:
+            blocks = [sampleBlocks(blocks, nGridpoints, args)]
+        limeFile.writeBlocks(
+            blocks,
+            bufferBytes=int(bufferSize * 2**20),
+        )
+        if geometryFile is None:
+            limeFile.writeSinks(sinkpoints)
+
+
+def blocksForSlice(ff, leafSlice, batchSize, nWorkers, prefetch):
+    """returns iterable of block batches of leafSlice, read by a pool of
+    nWorkers processes, by a BlockPipeline with queues of prefetch batches or
+    directly"""
+    if nWorkers > 1:
+        return generateBatchesInParallel(ff, leafSlice, batchSize, nWorkers)
+    if prefetch is not None:
+        return BlockPipeline(ff, leafSlice, batchSize, depth=prefetch)
+    return ff.generateBlocksForSlice(leafSlice, batchSize, reuse=True)
+
+
+def resumeBlocksAndSinks(
+    limeFile, ff, progress, sinkpoints, batchSize, bufferSize, nWorkers, prefetch
+):
+    """writes the blocks and sinks not written before progress was recorded"""
+    firstBlock = int(progress["BLOCKS_DONE"])
+    leafSlice = slice(firstBlock, limeFile.nBlocks)
+    blocks = blocksForSlice(ff, leafSlice, batchSize, nWorkers, prefetch)
+    limeFile.writeBlocks(
+        blocks,
+        bufferBytes=int(bufferSize * 2**20),
+        firstBlock=firstBlock,
+        firstPoint=int(progress["POINTS_DONE"]),
+    )
+    if not progress["SINKS_DONE"]:
         limeFile.writeSinks(sinkpoints)
 
 
+def sampleBlocks(blocks, nPoints, args):
+    """selects nPoints gridpoints of blocks, weighted as given in args"""
+    field = args.samplefield if args.samplefield is not None else "density"
+    power = args.samplepower if args.samplepower is not None else 1
+    sampler = PointSampler(nPoints, field=sampleAttributes[field], power=power)
+    for block in blocks:
+        sampler.add(block)
+
+    return sampler.sample()
+
+
 if __name__ == "__main__":
     args = parseArgs()
 
@@ -0,0 +1,101 @@
+import numpy as np
+
+# molar masses [g/mol]
+molarMassH2 = 2.01588
+molarMassCO = 28.0101
+
+
+class DerivedField:
+    """column of a BlockBatch computed from its columns named in inputs, by
+    function(out, *inputs). Inputs are arrays of shape (components, nPoints),
+    out has shape (nPoints,). With perBlock=True, inputs have shape
+    (components, nBlocks, pointsPerBlock) and out (nBlocks,), the value of
+    a block is given to all its points"""
+
+    def __init__(self, inputs, function, perBlock=False):
+        self.inputs = inputs
+        self.function = function
+        self.perBlock = perBlock
+
+
+def h2Densities(out, densities, h2Fractions):
+    # densities assume all mass in H2, scale by the H2 mass fraction
+    np.multiply(densities[0], h2Fractions[0], out=out)
+
+
+def coDensities(out, densities, coFractions):
+    np.multiply(densities[0], coFractions[0], out=out)
+    out *= molarMassH2 / molarMassCO
+
+
+def abundances(out, coDensities, h2Densities):
+    # CO per H2 molecule, 0 without H2
+    out[:] = 0
+    np.divide(coDensities[0], h2Densities[0], out=out, where=h2Densities[0] > 0)
+
+
+def dopplerWidths(out, velocities):
+    # turbulent Doppler b = sqrt(2) sigma_1D from the dispersion of the cell
+    # velocities in each block, sigma_1D^2 = sigma_3D^2 / 3. Same unit as the
+    # VEL columns
+    np.sum(np.var(velocities, axis=2), axis=0, out=out)
+    out *= 2 / 3
+    np.sqrt(out, out=out)
+
+
+# name: field, names are block attributes like those of FlashBlock.
+# Inputs are block attributes, other derived fields or FLASH unknowns
+derivedFields = {
+    "h2densities": DerivedField(["densities", "ih2"], h2Densities),
+    "codensities": DerivedField(["densities", "ico"], coDensities),
+    "abundances": DerivedField(["codensities", "h2densities"], abundances),
+    "dopplerwidths": DerivedField(["velocities"], dopplerWidths, perBlock=True),
+}
+
+# name: block attribute whose gradient magnitude the field holds. Gradients
+# need the blocks unflattened, FlashFactory computes them on transforming
+gradientFields = {"densitygradients": "densities"}
+
+
+def gradientMagnitudes(values, bbs):
+    """returns |grad values| of np.array (nBlocks,nz,ny,nx), FLASH's layout,
+    in blocks of boundingboxes (nBlocks,3,2). Central differences inside
+    blocks, one-sided ones at block edges, 0 along edges of a single cell"""
+    bbs = np.reshape(bbs, (-1, 3, 2))
+    # value axes 1,2,3 run along z, y and x
+    deltas = (bbs[:, ::-1, 1] - bbs[:, ::-1, 0]) / np.array(values.shape[1:])
+    squares = np.zeros(values.shape)
+    for axis in range(3):
+        if values.shape[axis + 1] < 2:
+            continue
+        derivative = np.gradient(values, axis=axis + 1)
+        derivative /= deltas[:, axis, np.newaxis, np.newaxis, np.newaxis]
+        squares += derivative**2
+    return np.sqrt(squares)
+
+
+def inputsFor(names):
+    """returns set of the names that are not derived fields, and of the
+    inputs the derived fields among names depend on"""
+    inputs = set()
+    for name in names:
+        if name in derivedFields:
+            inputs |= inputsFor(derivedFields[name].inputs)
+        elif name in gradientFields:
+            inputs |= {name, gradientFields[name]}
+        else:
+            inputs.add(name)
+    return inputs
+
+
+def evaluateField(field, inputs, nBlocks, out):
+    """evaluates DerivedField field for input arrays of shape
+    (components, nPoints) into out of shape (nPoints,)"""
+    if not field.perBlock:
+        field.function(out, *inputs)
+        return
+    blockValues = np.empty(nBlocks, dtype=out.dtype)
+    field.function(
+        blockValues, *(values.reshape(len(values), nBlocks, -1) for values in inputs)
+    )
+    out.reshape(nBlocks, -1)[:] = blockValues[:, np.newaxis]
@@ -4,45 +4,213 @@ import h5py
 import numpy as np
 
 from helper import flatten3DValues
+from geometry import (
+    gridpointsForBoundingboxes,
+    fillGridpointsForBoundingboxes,
+    domainCenter,
+    recenterBoundingboxes,
+    enclosingRadius,
+    minscaleForBoundingboxes,
+)
+from coarsen import coarseningFactors, coarsenBlocks, coarseIndices
+from spatialIndex import LeafIndex
+from flashMetadata import loadFlashMetadata
+from ioGate import ioSlot
+from mappedDatasets import memmapForDataset
+from derivedFields import (
+    derivedFields,
+    evaluateField,
+    gradientFields,
+    gradientMagnitudes,
+)
+from metrics import stage, count, nbytes
 
 
 class FlashFactory:
-    def __init__(self, flash_file):
+    # leaves further apart in the file are read with separate hyperslabs
+    maxReadGap = 64
+
+    # block attribute: FLASH unknowns it is read from
+    attributeFields = {
+        "temperatures": ("temp",),
+        "dusttemperatures": ("tdus",),
+        "densities": ("dens",),
+        "velocities": ("velx", "vely", "velz"),
+        "magfluxes": ("magx", "magy", "magz"),
+    }
+
+    # position of scalar block attributes in the values of readBatch
+    scalarValues = {"temperatures": 1, "dusttemperatures": 2, "densities": 3}
+
+    def __init__(
+        self,
+        flash_file,
+        center=False,
+        fullLevels=None,
+        region=None,
+        sidecar=False,
+        extraFields=(),
+        columns=None,
+        memmap=True,
+    ):
+        """center=True moves the center of the FLASH domain to the origin,
+        or with region the center of the leaves intersecting it.
+        If fullLevels is given, only blocks on the fullLevels finest
+        refinement levels keep all gridpoints, coarser blocks are averaged
+        down to 4^3, 2^3 or 1 gridpoint. region restricts the leaves to those
+        intersecting a region as given to LeafIndex.region. sidecar=True
+        caches the file metadata next to the FLASH file. extraFields are
+        FLASH unknowns read into block batches for derived fields. columns
+        are the block attributes of attributeFields to read, defaults to all,
+        the unknowns of other attributes are never read. With memmap=True,
+        contiguous uncompressed datasets are read through memory maps,
+        others through h5py"""
         self.file = flash_file
-        self.bb = self.file["bounding box"]  # needs no get(), bb is required
-        self.densities = self.file.get("dens")
-        self.temperatures = self.file.get("temp")
-        self.dusttemperatures = self.file.get("tdus")
-        self.refinementLevels = self.file.get("refine level")
+        self.options = {
+            "center": center,
+            "fullLevels": fullLevels,
+            "region": region,
+            "sidecar": sidecar,
+            "extraFields": extraFields,
+            "columns": columns,
+            "memmap": memmap,
+        }
+        self.memmap = memmap
+        unknown = set(columns or ()) - set(self.attributeFields)
+        if unknown:
+            raise ValueError(f"Unknown block attributes {sorted(unknown)}.")
+        self.columns = set(self.attributeFields if columns is None else columns)
+        self.fullLevels = fullLevels
+        if extraFields and fullLevels is not None:
+            raise ValueError("Derived fields can not be used with coarsened blocks.")
+        with stage("metadata"):
+            metadata = loadFlashMetadata(self.file, sidecar)
+        self.bb = metadata["bb"]
+        # unknowns of the file, checked instead of looking up datasets
+        self.fields = [str(name) for name in metadata["fields"]]
+        # gradient fields are computed, the others read from the file
+        self.gradientFields = [name for name in extraFields if name in gradientFields]
+        fileFields = [name for name in extraFields if name not in gradientFields]
+        missing = [name for name in fileFields if name not in self.fields]
+        if missing:
+            raise ValueError(f"FLASH file has no fields {missing} to derive from.")
+        self.extraFields = {
+            name: self.mappedDataset(self.file[name]) for name in fileFields
+        }
+        self.densities = self.datasetsForAttribute("densities")[0]
+        self.temperatures = self.datasetsForAttribute("temperatures")[0]
+        self.dusttemperatures = self.datasetsForAttribute("dusttemperatures")[0]
+        self.refinementLevels = self.mappedDataset(self.file.get("refine level"))
         self.blockSizes = self.file.get("block size")
-        self.radius = np.sqrt(
-            np.max(self.blockSizes[0][0]) ** 2
-            + np.max(self.blockSizes[0][1]) ** 2
-            + np.max(self.blockSizes[0][2]) ** 2
-        )
-        self.minscale = (
-            np.max(self.blockSizes[0]) / (2 ** (np.max(self.refinementLevels) - 1)) / 8
-        )
-        self.vels = (
-            self.file.get("velx"),
-            self.file.get("vely"),
-            self.file.get("velz"),
-        )
-        self.mags = (
-            self.file.get("magx"),
-            self.file.get("magy"),
-            self.file.get("magz"),
-        )
-        self.leaves = np.where(np.array(self.file["node type"]) == 1)[0]
+        self.vels = self.datasetsForAttribute("velocities")
+        self.mags = self.datasetsForAttribute("magfluxes")
+        self.leaves = metadata["leaves"]
         self.gpIndices = np.meshgrid(
-            *[range(nib) for nib in self.densities[0].shape], indexing="ij"
+            *[range(nib) for nib in metadata["blockShape"]], indexing="ij"
         )
+        self._Ix = self.gpIndices[0]
+        if region is not None:
+            self.leaves = LeafIndex(self.leaves, self.bb).region(region)
+            if len(self.leaves) == 0:
+                raise ValueError(f"No FLASH leaf blocks in region {region}.")
+        if center:
+            self.bb = recenterBoundingboxes(self.bb, domainCenter(self.bb[self.leaves]))
+
+        # diagonal of the first root block, grown if it does not envelop
+        # all blocks around the origin, e.g. for offset domains. Regions get
+        # the radius of their leaves
+        self.radius = enclosingRadius(self.bb[self.leaves])
+        if region is None:
+            self.radius = max(metadata["rootDiagonal"], self.radius)
+        self.minscale = minscaleForBoundingboxes(self.bb, metadata["blockShape"])
+        self.maxLevel = metadata["maxLevel"]
+        self.chunkBlocks = self.chunkBlocksForDatasets()
+
+    def datasetsForAttribute(self, attribute):
+        """returns tuple of the datasets of block attribute, None for
+        unknowns missing in the file or attributes not in columns"""
+        if attribute not in self.columns:
+            return (None,) * len(self.attributeFields[attribute])
+        return tuple(
+            self.mappedDataset(self.file[name]) if name in self.fields else None
+            for name in self.attributeFields[attribute]
+        )
+
+    def mappedDataset(self, dataset):
+        """returns dataset, as np.memmap if enabled and possible"""
+        if not self.memmap:
+            return dataset
+        return memmapForDataset(dataset)
+
+    def generateBlocksForSlice(self, blockslice, batchSize=None, reuse=False):
+        """yields a FlashBlock per leaf in blockslice. If batchSize is given,
+        yields FlashBlockBatches of up to batchSize leaves instead. With
+        reuse=True, every batch is filled into the arrays of the previous one,
+        so a batch is only valid until the next one is generated"""
+        if batchSize is not None:
+            return self.generateBatchesForSlice(blockslice, batchSize, reuse)
+        return (self.createBlock(blockId) for blockId in self.leaves[blockslice])
+
+    def generateBatchesForSlice(self, blockslice, batchSize, reuse=False):
+        out = BlockBatch() if reuse else None
+        for start, stop in self.leafRangesForSlice(blockslice, batchSize):
+            yield self.createBatch(self.leaves[start:stop], out)
+
+    def chunkBlocksForDatasets(self):
+        """returns the largest number of blocks per chunk of the chunked
+        field datasets, 1 if none is chunked"""
+        datasets = [
+            self.densities,
+            self.temperatures,
+            self.dusttemperatures,
+            *self.vels,
+            *self.mags,
+            *self.extraFields.values(),
+        ]
+        chunks = [getattr(dataset, "chunks", None) for dataset in datasets]
+        return max([chunk[0] for chunk in chunks if chunk is not None], default=1)
+
+    def chunkCache(self):
+        """returns h5py.File keywords of the chunk cache of the FLASH file, to
+        open it alike in other processes"""
+        _, nSlots, nBytes, _ = self.file.id.get_access_plist().get_cache()
+        return {"rdcc_nslots": nSlots, "rdcc_nbytes": nBytes}
+
+    def leafRangesForSlice(self, blockslice, batchSize):
+        """returns list of [start, stop) of leaf batches of blockslice, of
+        batchSize leaves each, extended to the last leaf in the chunk of their
+        last leaf. Leaves keep their order, but no chunk is read by two batches
+        and so decompressed twice"""
+        start, stop, _ = blockslice.indices(len(self.leaves))
+        chunkIds = self.leaves // self.chunkBlocks
+        leafRanges = []
+        while start < stop:
+            end = min(start + batchSize, stop)
+            chunkEnd = np.searchsorted(chunkIds, chunkIds[end - 1], side="right")
+            end = min(max(end, int(chunkEnd)), stop)
+            leafRanges.append((start, end))
+            start = end
+        return leafRanges
 
-    def generateBlocksForSlice(self, blockslice):
-        for blockId in self.leaves[blockslice]:
-            yield self.createBlock(blockId)
+    def gridpointsForSlice(self, blockslice):
+        """returns number of gridpoints of all leaves in blockslice"""
+        leaves = self.leaves[blockslice]
+        if self.fullLevels is None:
+            return len(leaves) * self._Ix.size
+        factors = self.coarseningFactorsForBlocks(leaves)
+        return int(np.sum(self._Ix.size // factors**3))
+
+    def coarseningFactorsForBlocks(self, blockIds):
+        return coarseningFactors(
+            self.readBlocks(self.refinementLevels, blockIds),
+            self.maxLevel,
+            self.fullLevels,
+            maxFactor=min(self._Ix.shape),
+        )
 
     def createBlock(self, blockId):
+        if self.fullLevels is not None:
+            return self.createBatch(np.array([blockId]))
         return FlashBlock(
             blockId,
             self.gpIndices,
@@ -54,6 +222,90 @@ class FlashFactory:
             self.magfluxesForBlock(blockId),
         )
 
+    def createBatch(self, blockIds, out=None):
+        return self.transformBatch(blockIds, self.readBatch(blockIds), out)
+
+    def transformBatch(self, blockIds, values, out=None):
+        """builds the block batch of blockIds from values read by readBatch.
+        If BlockBatch out is given, it is refilled instead, unless blocks are
+        coarsened"""
+        count("transform", nBlocks=len(blockIds))
+        with stage("transform"):
+            values = self.addGradients(values)
+            if self.fullLevels is not None:
+                return CoarseBlockBatch(
+                    blockIds,
+                    self.coarseningFactorsForBlocks(blockIds),
+                    self._Ix.shape,
+                    *values,
+                )
+            if out is None:
+                return FlashBlockBatch(blockIds, self.gpIndices, *values)
+            out.fill(blockIds, self.gpIndices, *values)
+            return out
+
+    def addGradients(self, values):
+        """returns values read by readBatch with the gradientFields added to
+        its extra fields"""
+        if not self.gradientFields:
+            return values
+        extras = dict(values[6])
+        for name in self.gradientFields:
+            attributeValues = values[self.scalarValues[gradientFields[name]]]
+            extras[name] = gradientMagnitudes(attributeValues, values[0])
+        return values[:6] + (extras,)
+
+    def readBatch(self, blockIds):
+        """returns boundingboxes, temperatures, dust temperatures, densities,
+        velocities, magnetic fluxes and a dict of the extra fields of blockIds"""
+        with ioSlot(), stage("read"):
+            values = (
+                self.readBlocks(self.bb, blockIds),
+                self.readBlocks(self.temperatures, blockIds),
+                self.readBlocks(self.dusttemperatures, blockIds),
+                self.readBlocks(self.densities, blockIds),
+                self.readBlocksForDatasets(self.vels, blockIds),
+                self.readBlocksForDatasets(self.mags, blockIds),
+                {
+                    name: self.readBlocks(dataset, blockIds)
+                    for name, dataset in self.extraFields.items()
+                },
+            )
+        count("read", nbytes(values), len(blockIds))
+        return values
+
+    def readBlocks(self, dataset, blockIds):
+        """reads sorted blockIds from dataset with one hyperslab per span of
+        blockIds without gaps larger than maxReadGap. Spans of chunked
+        datasets only break where whole chunks hold none of blockIds, so every
+        chunk read is decompressed once. Memory mapped values are copied, so
+        their pages are read here and not on first use. returns np.array of
+        shape (len(blockIds), ...)"""
+        if dataset is None:
+            return None
+        if len(blockIds) == 0:
+            return dataset[0:0]
+        chunks = getattr(dataset, "chunks", None)
+        if chunks is None:
+            gaps = np.diff(blockIds) > self.maxReadGap
+        else:
+            gaps = np.diff(blockIds // chunks[0]) > 1
+        spans = np.split(blockIds, np.flatnonzero(gaps) + 1)
+        if blockIds[-1] - blockIds[0] == len(blockIds) - 1:
+            # consecutive leaves, one hyperslab or copy of the mapped pages
+            values = dataset[blockIds[0] : blockIds[-1] + 1]
+            return np.array(values) if isinstance(values, np.memmap) else values
+        if len(spans) == 1:
+            return dataset[blockIds[0] : blockIds[-1] + 1][blockIds - blockIds[0]]
+        return np.concatenate(
+            [dataset[span[0] : span[-1] + 1][span - span[0]] for span in spans]
+        )
+
+    def readBlocksForDatasets(self, datasets, blockIds):
+        if datasets[0] is None:
+            return None
+        return tuple(self.readBlocks(dataset, blockIds) for dataset in datasets)
+
     def gastemperaturesForBlock(self, blockId):
         try:
             return self.temperatures[blockId]
@@ -73,12 +325,12 @@ class FlashFactory:
             return None
 
     def velocitiesForBlock(self, blockId):
-        if not self.vels[0]:
+        if self.vels[0] is None:
             return None
         return (self.vels[0][blockId], self.vels[1][blockId], self.vels[2][blockId])
 
     def magfluxesForBlock(self, blockId):
-        if not self.mags[0]:
+        if self.mags[0] is None:
             return None
         return (self.mags[0][blockId], self.mags[1][blockId], self.mags[2][blockId])
 
@@ -100,16 +352,12 @@ class FlashBlock:
         self.magfluxes = self.magfluxes(mags)
 
     def gridpointsForBoundingbox(self, bb):
-        """takes np.array of shape (3,2) [nx,ny,nz, (upper/lower)]. returns
-        np.array of coordinates of shape (nx * ny * nz, 3)"""
+        """takes np.array of shape (3,2) [nx,ny,nz, (upper/lower)], or
+        (nBlocks,3,2) for batches. returns np.array of coordinates of shape
+        (nBlocks * nx * ny * nz, 3)"""
 
-        (dx, x0), (dy, y0), (dz, z0) = [
-            ((bb[i][1] - bb[i][0]) / 8, bb[i][0]) for i in range(3)
-        ]
-        return (
-            np.array([self._Ix * dx + x0, self._Iy * dy + y0, self._Iz * dz + z0])
-            .reshape(3, -1)
-            .T
+        return gridpointsForBoundingboxes(
+            np.reshape(bb, (-1, 3, 2)), (self._Ix, self._Iy, self._Iz)
         )
 
     def temperatures(self, temperatures):
@@ -137,3 +385,256 @@ class FlashBlock:
         # returns array of shape (512,3)
         if magfluxes is not None:
             return flatten3DValues(magfluxes[0], magfluxes[1], magfluxes[2])
+
+
+class BlockBatch:
+    """columnar batch of FLASH blocks. Each property is held as array of shape
+    (components, nPoints), every component contiguous and flattened like
+    FlashBlock does. fill reuses the arrays of earlier fills if they are large
+    enough, so refilling a batch does not allocate. The FlashBlock attributes
+    (gridpoints, densities, ...) are views into these arrays"""
+
+    __slots__ = ("id", "nBlocks", "nPoints", "arrays", "columns")
+
+    # property: number of components
+    properties = {
+        "gridpoints": 3,
+        "temperatures": 1,
+        "dusttemperatures": 1,
+        "densities": 1,
+        "velocities": 3,
+        "magfluxes": 3,
+    }
+
+    # 6.02214 * 10^23 N/mol / 2.01588 g/mol * 1e6 cm^3/m
+    moleculesPerGramH2 = 2.987350e29
+
+    def __init__(self):
+        self.id = None
+        self.nBlocks = 0
+        self.nPoints = 0
+        self.arrays = {}  # allocated arrays, kept between fills
+        self.columns = dict.fromkeys(self.properties)  # filled part or None
+
+    def __getstate__(self):
+        # only the filled columns are pickled, e.g. by worker processes.
+        # arrays are views of them after unpickling
+        return {
+            "id": self.id,
+            "nBlocks": self.nBlocks,
+            "nPoints": self.nPoints,
+            "columns": self.columns,
+        }
+
+    def __setstate__(self, state):
+        self.id = state["id"]
+        self.nBlocks = state["nBlocks"]
+        self.nPoints = state["nPoints"]
+        self.columns = state["columns"]
+        self.arrays = {
+            name: columns
+            for name, columns in self.columns.items()
+            if columns is not None
+        }
+
+    def fill(
+        self, blockIds, gpIndices, bbs, temp, tempdust, dens, vels, mags, extras=None
+    ):
+        """fills the batch with leaves blockIds, arguments as for FlashBlock.
+        extras is a dict of further FLASH unknowns of shape (nBlocks,nx,ny,nz),
+        held as columns of the same name"""
+        self.id = blockIds
+        self.nBlocks = len(blockIds)
+        self.nPoints = self.nBlocks * gpIndices[0].size
+        self.columns = dict.fromkeys(self.properties)
+
+        bbs = np.reshape(bbs, (-1, 3, 2))
+        gridpoints = self.columnsFor("gridpoints", bbs.dtype)
+        fillGridpointsForBoundingboxes(gridpoints, bbs, gpIndices)
+        self.fillColumns("temperatures", temp)
+        self.fillColumns("dusttemperatures", tempdust)
+        self.fillColumns("densities", dens, self.moleculesPerGramH2)
+        self.fillColumns("velocities", vels)
+        self.fillColumns("magfluxes", mags)
+        for name, values in (extras or {}).items():
+            self.fillColumns(name, values)
+
+    def columnsFor(self, name, dtype, nComponents=1):
+        """returns array of shape (nComponents, nPoints) of property name,
+        reallocated only if the kept one is too small or of another dtype"""
+        nComponents = self.properties.get(name, nComponents)
+        array = self.arrays.get(name)
+        if array is None or array.dtype != dtype or array.shape[1] < self.nPoints:
+            array = np.empty((nComponents, self.nPoints), dtype=dtype)
+            self.arrays[name] = array
+        self.columns[name] = array[:, : self.nPoints]
+        return self.columns[name]
+
+    def fillColumns(self, name, values, factor=None):
+        """flattens values of shape (nBlocks,nx,ny,nz), or a tuple of those,
+        into the columns of property name, multiplied by factor if given"""
+        if values is None:
+            self.columns[name] = None
+            return
+        components = values if isinstance(values, tuple) else (values,)
+        columns = self.columnsFor(name, components[0].dtype, len(components))
+        for column, component in zip(columns, components):
+            # column-major flattening of each block, like flatten3DValues
+            flattened = component.transpose(0, 3, 2, 1)
+            out = column.reshape(flattened.shape)
+            if factor is None:
+                np.copyto(out, flattened)
+            else:
+                np.multiply(flattened, factor, out=out)
+
+    def column(self, name, component=None):
+        """returns contiguous array of nPoints values of a component of
+        property name, or None if the batch does not hold it. Derived fields
+        are evaluated on first use, see derivedFields"""
+        columns = self.columnsOf(name)
+        if columns is None:
+            return None
+        return columns[0 if component is None else component]
+
+    def columnsOf(self, name):
+        """returns array of shape (components, nPoints) of property name,
+        evaluating derived fields and their inputs once per fill"""
+        if name in self.columns:
+            return self.columns[name]
+        if name not in derivedFields:
+            raise KeyError(f"Block batch has no field {name}.")
+        field = derivedFields[name]
+        inputs = [self.columnsOf(inputName) for inputName in field.inputs]
+        if any(values is None for values in inputs):
+            self.columns[name] = None
+            return None
+        out = self.columnsFor(name, np.result_type(*inputs))
+        evaluateField(field, inputs, self.nBlocks, out[0])
+        return out
+
+    def propertyView(self, name):
+        columns = self.columns[name]
+        if columns is None:
+            return None
+        if len(columns) == 1:
+            return columns[0]
+        return columns.T
+
+    @property
+    def gridpoints(self):
+        # returns array of shape (nPoints, 3)
+        return self.propertyView("gridpoints")
+
+    @property
+    def temperatures(self):
+        return self.propertyView("temperatures")
+
+    @property
+    def dusttemperatures(self):
+        return self.propertyView("dusttemperatures")
+
+    @property
+    def densities(self):
+        return self.propertyView("densities")
+
+    @property
+    def velocities(self):
+        # returns array of shape (nPoints, 3)
+        return self.propertyView("velocities")
+
+    @property
+    def magfluxes(self):
+        # returns array of shape (nPoints, 3)
+        return self.propertyView("magfluxes")
+
+
+class FlashBlockBatch(BlockBatch):
+    """BlockBatch of several leaves at once. Properties of all leaves in
+    blockIds are concatenated, e.g. densities has shape (nBlocks * 512,)
+    and gridpoints (nBlocks * 512, 3)"""
+
+    __slots__ = ()
+
+    def __init__(
+        self, blockIds, gpIndices, bbs, temp, tempdust, dens, vels, mags, extras=None
+    ):
+        super().__init__()
+        self.fill(blockIds, gpIndices, bbs, temp, tempdust, dens, vels, mags, extras)
+
+
+class CoarseBlockBatch:
+    """batch of leaves, each averaged down by its factor along every block
+    edge before being flattened like a FlashBlockBatch. Leaves keep their
+    order, but hold (nx/factor)^3 gridpoints each"""
+
+    properties = [
+        "gridpoints",
+        "temperatures",
+        "dusttemperatures",
+        "densities",
+        "velocities",
+        "magfluxes",
+    ]
+
+    def __init__(
+        self,
+        blockIds,
+        factors,
+        blockShape,
+        bbs,
+        temp,
+        tempdust,
+        dens,
+        vels,
+        mags,
+        extras=None,
+    ):
+        self.id = blockIds
+        self.nBlocks = len(blockIds)
+        pointsPerBlock = np.prod(blockShape) // factors**3
+        firstPoints = np.concatenate(([0], np.cumsum(pointsPerBlock)[:-1]))
+
+        for name in self.properties:
+            setattr(self, name, None)
+
+        for factor in np.unique(factors):
+            inGroup = factors == factor
+            group = FlashBlockBatch(
+                blockIds[inGroup],
+                coarseIndices(blockShape, factor),
+                bbs[inGroup],
+                coarsenValues(temp, inGroup, factor),
+                coarsenValues(tempdust, inGroup, factor),
+                coarsenValues(dens, inGroup, factor),
+                coarsenValues(vels, inGroup, factor),
+                coarsenValues(mags, inGroup, factor),
+            )
+            points = (
+                firstPoints[inGroup][:, np.newaxis]
+                + np.arange(np.prod(blockShape) // factor**3)
+            ).reshape(-1)
+
+            for name in self.properties:
+                values = getattr(group, name)
+                if values is None:
+                    continue
+                if getattr(self, name) is None:
+                    setattr(
+                        self,
+                        name,
+                        np.empty(
+                            (np.sum(pointsPerBlock),) + values.shape[1:],
+                            dtype=values.dtype,
+                        ),
+                    )
+                getattr(self, name)[points] = values
+
+
+def coarsenValues(values, inGroup, factor):
+    """coarsens blocks selected by inGroup of np.array (nBlocks,nx,ny,nz)
+    or of a tuple of those, None is passed through"""
+    if values is None:
+        return None
+    if isinstance(values, tuple):
+        return tuple(coarsenBlocks(component[inGroup], factor) for component in values)
+    return coarsenBlocks(values[inGroup], factor)
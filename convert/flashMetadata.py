@@ -0,0 +1,94 @@
+import os
+import hashlib
+
+import h5py
+import numpy as np
+
+# bytes of the FLASH file hashed into the sidecar key
+headerBytes = 64 * 2**10
+
+
+def sidecarPathForFile(flashFilePath):
+    return f"{flashFilePath}.limeindex.npz"
+
+
+def keyForFile(flashFilePath):
+    """returns (size, mtime in ns, hash of the file header)"""
+    stat = os.stat(flashFilePath)
+    with open(flashFilePath, "rb") as flashFile:
+        headerHash = hashlib.sha1(flashFile.read(headerBytes)).hexdigest()
+    return stat.st_size, stat.st_mtime_ns, headerHash
+
+
+def readFlashMetadata(flashFile):
+    """reads what FlashFactory needs to know about an open FLASH file
+    before reading any block"""
+    bb = flashFile["bounding box"][()]
+    blockSize = flashFile["block size"][0]
+    return {
+        "leaves": np.where(np.array(flashFile["node type"]) == 1)[0],
+        "bb": bb,
+        "blockShape": np.array(flashFile["dens"].shape[1:]),
+        "rootDiagonal": np.sqrt(
+            np.max(blockSize[0]) ** 2
+            + np.max(blockSize[1]) ** 2
+            + np.max(blockSize[2]) ** 2
+        ),
+        "maxLevel": np.max(flashFile["refine level"]),
+        "fields": np.array(
+            sorted(
+                name
+                for name, member in flashFile.items()
+                if isinstance(member, h5py.Dataset) and len(member.shape) == 4
+            )
+        ),
+    }
+
+
+def loadFlashMetadata(flashFile, sidecar=False):
+    """returns readFlashMetadata of flashFile. With sidecar=True, the result
+    is cached in a sidecar file next to the FLASH file, keyed by its size,
+    modification time and header hash. Stale sidecars are rebuilt, sidecars
+    that can not be written are skipped"""
+    if not sidecar:
+        return readFlashMetadata(flashFile)
+
+    flashFilePath = flashFile.filename
+    sidecarPath = sidecarPathForFile(flashFilePath)
+    size, mtime, headerHash = keyForFile(flashFilePath)
+
+    try:
+        with np.load(sidecarPath) as cached:
+            if (
+                cached["size"] == size
+                and cached["mtime"] == mtime
+                and str(cached["headerHash"]) == headerHash
+            ):
+                return {name: cached[name] for name in cached.files}
+    except (OSError, KeyError, ValueError):
+        pass
+
+    metadata = readFlashMetadata(flashFile)
+    try:
+        temporaryPath = f"{sidecarPath}.{os.getpid()}.tmp.npz"
+        np.savez(
+            temporaryPath,
+            size=size,
+            mtime=mtime,
+            headerHash=headerHash,
+            **metadata,
+        )
+        os.replace(temporaryPath, sidecarPath)
+    except OSError:
+        pass
+
+    return metadata
+
+
+def geometryDigest(flashFile):
+    """returns hash of the AMR mesh of an open FLASH file, equal for files
+    sharing bounding boxes, refinement levels and node types"""
+    digest = hashlib.sha1()
+    for name in ["bounding box", "refine level", "node type"]:
+        digest.update(np.ascontiguousarray(flashFile[name][()]).tobytes())
+    return digest.hexdigest()
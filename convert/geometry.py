@@ -0,0 +1,48 @@
+import numpy as np
+
+
+def gridpointsForBoundingboxes(bbs, gpIndices):
+    """takes np.array of shape (nBlocks,3,2) and the cell index grids
+    (Ix,Iy,Iz) of a block, each of shape (nx,ny,nz). returns np.array of
+    coordinates of shape (nBlocks * nx * ny * nz, 3)"""
+
+    gridpoints = np.empty((3, len(bbs) * gpIndices[0].size), dtype=bbs.dtype)
+    fillGridpointsForBoundingboxes(gridpoints, bbs, gpIndices)
+    return gridpoints.T
+
+
+def fillGridpointsForBoundingboxes(out, bbs, gpIndices):
+    """gridpointsForBoundingboxes writing x, y and z coordinates into the
+    rows of out, of shape (3, nBlocks * nx * ny * nz)"""
+    nCells = np.array(gpIndices[0].shape)
+    deltas = (bbs[:, :, 1] - bbs[:, :, 0]) / nCells
+    origins = bbs[:, :, 0]
+    for i, indices in enumerate(gpIndices):
+        coordinates = out[i].reshape(len(bbs), -1)
+        np.multiply(indices.reshape(-1), deltas[:, i : i + 1], out=coordinates)
+        np.add(coordinates, origins[:, i : i + 1], out=coordinates)
+
+
+def domainCenter(bbs):
+    """returns center of the region covered by boundingboxes of shape
+    (nBlocks,3,2), like centerAxis does for coordinates"""
+    return (np.max(bbs[:, :, 1], axis=0) + np.min(bbs[:, :, 0], axis=0)) / 2
+
+
+def recenterBoundingboxes(bbs, center):
+    """shifts boundingboxes of shape (nBlocks,3,2) so that center becomes
+    the origin"""
+    return bbs - np.asarray(center)[np.newaxis, :, np.newaxis]
+
+
+def enclosingRadius(bbs, center=(0.0, 0.0, 0.0)):
+    """returns radius of smallest sphere around center enveloping all
+    boundingboxes of shape (nBlocks,3,2)"""
+    farthestCorners = np.max(np.abs(recenterBoundingboxes(bbs, center)), axis=2)
+    return np.sqrt(np.max(np.sum(farthestCorners**2, axis=1)))
+
+
+def minscaleForBoundingboxes(bbs, nCells):
+    """returns edge length of the smallest cell, taking the largest edge of
+    cells with nCells = (nx,ny,nz) per block"""
+    return np.min(np.max((bbs[:, :, 1] - bbs[:, :, 0]) / np.asarray(nCells), axis=1))
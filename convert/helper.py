@@ -1,4 +1,5 @@
 import h5py
+import pathlib
 import argparse
 import textwrap
 import numpy as np
@@ -6,6 +7,8 @@ from h5py import string_dtype
 from h5py import Datatype
 from h5py.h5t import TypeID, STR_NULLTERM
 
+from sinks import randomSphereVolume
+
 
 def createArgumentParser():
     arg_parser = argparse.ArgumentParser(
@@ -26,6 +29,13 @@ def createArgumentParser():
     arg_parser.add_argument(
         "outFile", metavar="LIME file path", type=str, help="Path of LIME file"
     )
+    addConversionArguments(arg_parser)
+
+    return arg_parser
+
+
+def addConversionArguments(arg_parser):
+    """adds the options of a single conversion to arg_parser"""
     arg_parser.add_argument(
         "-b",
         "--blocks",
@@ -44,25 +54,250 @@ def createArgumentParser():
         type=float,
         help="Scale factor to apply to radius of sink points. Defaults to 1",
     )
+    arg_parser.add_argument(
+        "--sinkmode",
+        choices=["random", "lattice"],
+        help="Place sink points randomly or evenly on a Fibonacci lattice. "
+        "Defaults to random",
+    )
+    arg_parser.add_argument(
+        "--sinkseed", type=int, help="Seed of randomly placed sink points"
+    )
+    arg_parser.add_argument(
+        "--sinkspacing",
+        type=float,
+        metavar="FACTOR",
+        help="Instead of --sinks, use as many sink points as are FACTOR times "
+        "the smallest cell size apart on the sink sphere",
+    )
+    arg_parser.add_argument(
+        "--center",
+        action="store_true",
+        help="Move the center of the FLASH domain to the origin. With --sphere, "
+        "--box or --cone, the center of the included leaf blocks is moved there",
+    )
+    arg_parser.add_argument(
+        "--coarsen",
+        type=int,
+        metavar="LEVELS",
+        help="Keep all gridpoints only for blocks on the LEVELS finest refinement "
+        "levels, average coarser blocks down to 4^3, 2^3 or 1 gridpoint",
+    )
+    arg_parser.add_argument(
+        "--sphere",
+        type=float,
+        nargs=4,
+        metavar=("X", "Y", "Z", "R"),
+        help="Only include FLASH leaf blocks intersecting the sphere around X,Y,Z "
+        "with radius R, in FLASH units",
+    )
+    arg_parser.add_argument(
+        "--box",
+        type=float,
+        nargs=6,
+        metavar=("X0", "Y0", "Z0", "X1", "Y1", "Z1"),
+        help="Only include FLASH leaf blocks intersecting the box with lower "
+        "corner X0,Y0,Z0 and upper corner X1,Y1,Z1",
+    )
+    arg_parser.add_argument(
+        "--cone",
+        type=float,
+        nargs=8,
+        metavar=("X", "Y", "Z", "DX", "DY", "DZ", "ANGLE", "LENGTH"),
+        help="Only include FLASH leaf blocks intersecting the cone with apex "
+        "X,Y,Z, opening along DX,DY,DZ with half angle ANGLE in degrees, up to "
+        "LENGTH (may be inf)",
+    )
+    arg_parser.add_argument(
+        "--columns",
+        choices=[
+            "density",
+            "gastemperature",
+            "dusttemperature",
+            "velocity",
+            "magfield",
+        ],
+        nargs="+",
+        help="LIME columns to write besides positions, FLASH fields only needed "
+        "by others are not read. Defaults to density gastemperature velocity "
+        "magfield",
+    )
+    arg_parser.add_argument(
+        "--derived",
+        choices=["h2density", "abundance", "doppler"],
+        nargs="+",
+        help="Derived fields to write: h2density writes the H2 number density "
+        "(FLASH field ih2) as DENSITY1, abundance the CO abundance (fields ih2, "
+        "ico) as ABUNMOL1, doppler the turbulent Doppler width of each block "
+        "as TURBDPLR",
+    )
+    arg_parser.add_argument(
+        "--pointbudget",
+        type=int,
+        metavar="N",
+        help="Select N gridpoints from all included blocks, with probability "
+        "weighted by --samplefield",
+    )
+    arg_parser.add_argument(
+        "--samplefield",
+        choices=["density", "temperature", "dusttemperature", "densitygradient"],
+        help="Field weighting the selection of --pointbudget, densitygradient "
+        "is the magnitude of the density gradient. Defaults to density",
+    )
+    arg_parser.add_argument(
+        "--samplepower",
+        type=float,
+        help="Power applied to --samplefield for weighting. Defaults to 1",
+    )
+    arg_parser.add_argument(
+        "--sidecar",
+        action="store_true",
+        help="Cache FLASH file metadata in a sidecar file next to the FLASH file "
+        "to speed up repeated conversions",
+    )
+    arg_parser.add_argument(
+        "--nomemmap",
+        action="store_true",
+        help="Read all FLASH datasets through HDF5. By default, contiguous "
+        "uncompressed datasets are memory mapped and read without HDF5",
+    )
+    arg_parser.add_argument(
+        "--chunkcache",
+        type=float,
+        metavar="MB",
+        help="Size of the HDF5 chunk cache of each chunked FLASH dataset in MB. "
+        "Defaults to 1",
+    )
+    arg_parser.add_argument(
+        "--chunkslots",
+        type=int,
+        help="Number of hash table slots of the HDF5 chunk cache, best a prime "
+        "about 100 times the chunks fitting into --chunkcache. Defaults to 521",
+    )
+    arg_parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue an interrupted conversion into an existing LIME file "
+        "of the same FLASH file and arguments",
+    )
+    arg_parser.add_argument(
+        "--batchsize",
+        type=int,
+        help="Number of FLASH leaf blocks read at once. Defaults to 256",
+    )
+    arg_parser.add_argument(
+        "--prefetch",
+        type=int,
+        metavar="DEPTH",
+        help="Read and transform FLASH blocks in threads ahead of writing, "
+        "keeping up to DEPTH batches queued between stages",
+    )
+    arg_parser.add_argument(
+        "--metrics",
+        metavar="PATH",
+        help="Write wall time, bytes, blocks per second and peak memory of "
+        "each conversion stage, and --prefetch pipeline stalls, to json file "
+        "PATH. Stages run by --workers processes are not included. Batch and "
+        "series conversions write <LIME file>.metrics.json per file instead",
+    )
+    arg_parser.add_argument(
+        "--profile",
+        metavar="PATH",
+        help="Write cProfile statistics of the conversion to PATH. Batch and "
+        "series conversions write <LIME file>.prof per file instead",
+    )
+    arg_parser.add_argument(
+        "--tracemalloc",
+        action="store_true",
+        help="Add the traced peak memory and top allocation sites to --metrics",
+    )
+    arg_parser.add_argument(
+        "--buffersize",
+        type=float,
+        help="Size of the LIME write buffer in MB. Defaults to 64",
+    )
+    arg_parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        help="Number of processes reading and transforming FLASH blocks. Defaults to 1",
+    )
+    arg_parser.add_argument(
+        "--shards",
+        action="store_true",
+        help="Write the blocks of every worker into a shard file of their own, "
+        "joined into the LIME file by virtual datasets",
+    )
+    arg_parser.add_argument(
+        "--storage",
+        choices=["contiguous", "chunked", "gzip", "lzf"],
+        help="Storage of LIME columns, gzip and lzf are chunked and compressed. "
+        "Defaults to contiguous",
+    )
+    arg_parser.add_argument(
+        "--chunkblocks",
+        type=int,
+        help="Number of blocks per chunk of chunked storage. Defaults to 64",
+    )
+    arg_parser.add_argument(
+        "--shuffle",
+        action="store_true",
+        help="Apply the HDF5 shuffle filter to chunked storage",
+    )
 
-    return arg_parser
 
+def storageForArgs(args):
+    """returns keywords of LimeFile.setupStorage for parsed arguments"""
+    storage = args.storage if args.storage is not None else "contiguous"
+    chunked = storage != "contiguous" or args.shuffle
+    return {
+        "layout": "chunked" if chunked else "contiguous",
+        "chunkBlocks": args.chunkblocks if args.chunkblocks is not None else 64,
+        "compression": storage if storage in ("gzip", "lzf") else None,
+        "shuffle": args.shuffle,
+    }
+
+
+def chunkCacheForArgs(args):
+    """returns h5py.File keywords of the FLASH file chunk cache for parsed
+    arguments, HDF5 defaults are kept for options not given"""
+    chunkCache = {}
+    if args.chunkcache is not None:
+        chunkCache["rdcc_nbytes"] = int(args.chunkcache * 2**20)
+    if args.chunkslots is not None:
+        chunkCache["rdcc_nslots"] = args.chunkslots
+    return chunkCache
+
+
+def metricsForOutFile(args, outFile):
+    """returns metrics and profile arguments of the conversion into outFile of
+    a batch or series, paths next to outFile if args asks for them"""
+    return {
+        "metrics": f"{outFile}.metrics.json" if args.metrics is not None else None,
+        "profile": f"{outFile}.prof" if args.profile is not None else None,
+    }
 
-def sampleSphere(npoints):
-    """generates points randomly placed in volume of unit sphere"""
-    phi = np.random.uniform(0, 2 * np.pi, npoints)
-    theta = np.arccos(np.random.uniform(-1, 1, npoints))
-    u = np.random.uniform(0, 1, npoints)
 
-    coords = np.zeros((npoints, 3))
+def outFileForFlashFile(outDir, flashFilePath):
+    """returns path of the LIME file for a FLASH file converted into outDir"""
+    return pathlib.Path(outDir) / f"{pathlib.Path(flashFilePath).name}.h5"
 
-    for i in range(npoints):
-        r = u[i] ** 1 / 3
-        coords[i, 0] = r * np.sin(theta[i]) * np.cos(phi[i])
-        coords[i, 1] = r * np.sin(theta[i]) * np.sin(phi[i])
-        coords[i, 2] = r * np.cos(theta[i])
 
-    return coords
+def regionForArgs(args):
+    """returns region of parsed arguments as needed by LeafIndex.region"""
+    if args.sphere is not None:
+        return ("sphere", (tuple(args.sphere[:3]), args.sphere[3]))
+    if args.box is not None:
+        return ("box", (tuple(args.box[:3]), tuple(args.box[3:])))
+    if args.cone is not None:
+        return ("cone", (tuple(args.cone[:3]), tuple(args.cone[3:6]), *args.cone[6:]))
+    return None
+
+
+def sampleSphere(npoints):
+    """generates points randomly placed in volume of unit sphere,
+    returns np.array of shape (npoints, 3)"""
+    return randomSphereVolume(npoints).T
 
 
 def sampleSphereSurface(npoints, ndim=3):
@@ -90,13 +325,16 @@ def flatten3DValues(valuesX, valuesY, valuesZ):
     ).T
 
 
+def contiguousRuns(mask):
+    """returns np.array of shape (nRuns,2) holding [start, stop) of every
+    run of True values in 1D boolean mask"""
+    edges = np.diff(np.concatenate(([False], mask, [False])).astype(np.int8))
+    return np.flatnonzero(edges).reshape(-1, 2)
+
+
 def radiusForBoundingboxes(boundingboxes):
     """returns 3D radius of sphere guaranteed to envelop region
     defined in list of boundingboxes"""
-    xMax = yMax = zMax = 0
-    for bb in boundingboxes:
-        xMax = max(xMax, max(np.abs(bb[0][1]), abs(bb[0][0])))
-        yMax = max(yMax, max(abs(bb[1][1]), abs(bb[1][0])))
-        zMax = max(zMax, max(abs(bb[2][1]), abs(bb[2][0])))
+    xMax, yMax, zMax = np.max(np.abs(np.asarray(boundingboxes)), axis=(0, 2))
 
     return np.sqrt(xMax**2 + yMax**2 + zMax**2)
@@ -0,0 +1,20 @@
+import contextlib
+
+# semaphore shared by all processes converting at the same time, None when
+# I/O is not limited
+ioSemaphore = None
+
+
+def setIoSemaphore(semaphore):
+    global ioSemaphore
+    ioSemaphore = semaphore
+
+
+@contextlib.contextmanager
+def ioSlot():
+    """holds one of the I/O slots of ioSemaphore while reading or writing"""
+    if ioSemaphore is None:
+        yield
+        return
+    with ioSemaphore:
+        yield
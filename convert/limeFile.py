@@ -1,12 +1,35 @@
+import os
+import json
 import h5py
 
 import numpy as np
 
+from helper import contiguousRuns
+from ioGate import ioSlot
+from metrics import stage, count
+
 from h5py import string_dtype
 from h5py import Datatype
 from h5py.h5t import TypeID, STR_NULLTERM
 
 
+# columns only depending on the FLASH mesh and the sinks
+geometryColumns = ["ID", "X1", "X2", "X3", "IS_SINK"]
+
+# number of points generated at once for computed columns like ID
+generatedChunkPoints = 2**20
+
+
+def progressForFile(path):
+    """returns attributes of the CONVERSION group of LIME file path, written
+    by LimeFile.setupProgress, or None if there is no such file or group"""
+    try:
+        with h5py.File(path, "r") as limeFile:
+            return dict(limeFile["CONVERSION"].attrs)
+    except (OSError, KeyError):
+        return None
+
+
 def nulltermStringType(length):
     type_id = TypeID.copy(h5py.h5t.C_S1)
     type_id.set_size(length)
@@ -16,6 +39,18 @@ def nulltermStringType(length):
 
 
 class LimeFile:
+    # property of setupProperties: block attributes its columns are written from
+    propertyAttributes = {
+        "Density": ["densities"],
+        "GasTemperature": ["temperatures"],
+        "DustTemperature": ["dusttemperatures"],
+        "Velocity": ["velocities"],
+        "Magfield": ["magfluxes"],
+        "H2Density": ["h2densities"],
+        "Abundance": ["abundances"],
+        "Doppler": ["dopplerwidths"],
+    }
+
     def __init__(self, *args):
         self.args = args
         self.nBlocks = 0
@@ -23,6 +58,13 @@ class LimeFile:
         self.radius = 0.0
         self.minscale = 0.0
         self.gpPerBlock = 512
+        self.nGridpoints = 0
+        self.firstPoint = 0
+        self.shards = None
+        self.layout = "contiguous"
+        self.chunkBlocks = 64
+        self.compression = None
+        self.shuffle = False
         self.gridGroup = None
         self.gridColumnsGroup = None
         self.idDataset = None
@@ -33,13 +75,18 @@ class LimeFile:
         self.densityDataset = None
         self.gasTemperatureDataset = None
         self.dustTemperatureDataset = None
+        self.abundanceDataset = None
+        self.dopplerDataset = None
+        self.densityAttribute = "densities"
+        self.progressGroup = None
 
     def __enter__(self):
         self.file = h5py.File(*self.args)
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
-        self.file.__exit__(exc_type, exc_value, traceback)
+        with stage("close"):
+            self.file.__exit__(exc_type, exc_value, traceback)
 
     def setupFileAttributes(self, radius=0.0, minscale=0.0):
         self.radius = radius
@@ -68,14 +115,146 @@ class LimeFile:
             "CLASS", "DATA_GROUP", dtype=nulltermStringType(11)
         )
 
-    def setupPoints(self, nBlocks, nSinks=0, gridpoints=True):
-        """needs to be called before property setups. Number of Blocks and sinks need to be known"""
+    def setupPoints(
+        self, nBlocks, nSinks=0, gridpoints=True, firstPoint=0, nGridpoints=None
+    ):
+        """needs to be called before property setups. Number of Blocks and sinks need to be known.
+        firstPoint offsets the point IDs, e.g. for shards of a larger grid. nGridpoints
+        overrides the number of gridpoints of all blocks, e.g. for coarsened blocks"""
         self.gpPerBlock = 512 if gridpoints else 1
         self.nBlocks = nBlocks
+        self.nGridpoints = (
+            nGridpoints if nGridpoints is not None else nBlocks * self.gpPerBlock
+        )
         self.nSinks = nSinks
-        self.createIdDataset()
-        self.createPositionDatasets()
-        self.createSinkDataset()
+        self.firstPoint = firstPoint
+        with stage("setup"):
+            self.createIdDataset()
+            self.createPositionDatasets()
+            self.createSinkDataset()
+
+    def setupStorage(
+        self, layout="contiguous", chunkBlocks=64, compression=None, shuffle=False
+    ):
+        """sets the storage of all columns created afterwards. layout is
+        "contiguous" or "chunked" with chunks of chunkBlocks blocks.
+        compression ("gzip", "lzf") and shuffle need a chunked layout"""
+        if layout not in ("contiguous", "chunked"):
+            raise ValueError(f"Unknown layout {layout}, use contiguous or chunked.")
+        if layout == "contiguous" and (compression is not None or shuffle):
+            raise ValueError("Compression and shuffle need a chunked layout.")
+        self.layout = layout
+        self.chunkBlocks = chunkBlocks
+        self.compression = compression
+        self.shuffle = shuffle
+
+    def setupLinkedPoints(self, nBlocks, nSinks, nGridpoints, geometryFile, copy=False):
+        """alternative to setupPoints for a grid equal to the one of LIME file
+        geometryFile, e.g. a snapshot on the same FLASH mesh. ID, positions and
+        IS_SINK are external links to geometryFile, or copies with copy=True.
+        Only property columns are written afterwards"""
+        self.nBlocks = nBlocks
+        self.nSinks = nSinks
+        self.nGridpoints = nGridpoints
+
+        with h5py.File(geometryFile, "r") as source:
+            if source["GRID/columns/ID"].shape != (self.nPoints(),):
+                raise ValueError(
+                    f"{geometryFile} does not hold {self.nPoints()} points."
+                )
+            if copy:
+                for name in geometryColumns:
+                    source.copy(
+                        source[f"GRID/columns/{name}"], self.gridColumnsGroup, name=name
+                    )
+                return
+
+        linkPath = os.path.relpath(
+            geometryFile, os.path.dirname(os.path.abspath(self.file.filename))
+        )
+        for name in geometryColumns:
+            self.gridColumnsGroup[name] = h5py.ExternalLink(
+                linkPath, f"/GRID/columns/{name}"
+            )
+
+    def setupProgress(self, inFile, inFileKey, arguments):
+        """records the FLASH file, its key and the conversion arguments in the
+        CONVERSION group, which keeps the number of written blocks and points
+        up to date so an interrupted conversion can be resumed"""
+        self.progressGroup = self.file.create_group("CONVERSION")
+        self.progressGroup.attrs["IN_FILE"] = str(inFile)
+        self.progressGroup.attrs["IN_FILE_KEY"] = json.dumps(inFileKey)
+        self.progressGroup.attrs["ARGUMENTS"] = json.dumps(arguments, sort_keys=True)
+        self.progressGroup.attrs["N_BLOCKS"] = self.nBlocks
+        self.progressGroup.attrs["N_SINKS"] = self.nSinks
+        self.progressGroup.attrs["N_GRIDPOINTS"] = self.nGridpoints
+        # block attribute of every column, e.g. DENSITY1 may hold h2densities
+        self.progressGroup.attrs["COLUMN_ATTRIBUTES"] = json.dumps(
+            {
+                os.path.basename(dataset.name): attribute
+                for dataset, attribute, _ in self.blockColumns()
+            },
+            sort_keys=True,
+        )
+        self.recordProgress(0, 0)
+        self.progressGroup.attrs["SINKS_DONE"] = 0
+
+    def recordProgress(self, blocksDone, pointsDone):
+        """marks the first blocksDone blocks (pointsDone points) as written"""
+        if self.progressGroup is None:
+            return
+        self.progressGroup.attrs["BLOCKS_DONE"] = blocksDone
+        self.progressGroup.attrs["POINTS_DONE"] = pointsDone
+        self.file.flush()
+
+    def reopenPoints(self):
+        """picks up all columns of a LIME file opened for appending, as set
+        up by a previous conversion recording its progress"""
+        self.gridGroup = self.file["GRID"]
+        self.gridColumnsGroup = self.file["GRID/columns"]
+        self.progressGroup = self.file["CONVERSION"]
+        self.nBlocks = int(self.progressGroup.attrs["N_BLOCKS"])
+        self.nSinks = int(self.progressGroup.attrs["N_SINKS"])
+        self.nGridpoints = int(self.progressGroup.attrs["N_GRIDPOINTS"])
+
+        columns = self.gridColumnsGroup
+        self.idDataset = columns["ID"]
+        self.sinkDataset = columns["IS_SINK"]
+        self.positionDatasets = [columns[f"X{i}"] for i in range(1, 4)]
+        self.densityDataset = columns.get("DENSITY1")
+        self.gasTemperatureDataset = columns.get("TEMPKNTC")
+        self.dustTemperatureDataset = columns.get("TEMPDUST")
+        self.abundanceDataset = columns.get("ABUNMOL1")
+        self.dopplerDataset = columns.get("TURBDPLR")
+        self.velocityDatasets = [
+            columns[f"VEL{i}"] for i in range(1, 4) if f"VEL{i}" in columns
+        ]
+        self.magfieldDatasets = [
+            columns[f"B_FIELD{i}"] for i in range(1, 4) if f"B_FIELD{i}" in columns
+        ]
+        attributes = json.loads(self.progressGroup.attrs["COLUMN_ATTRIBUTES"])
+        self.densityAttribute = attributes.get("DENSITY1", "densities")
+
+    def setupShards(self, shards):
+        """makes all columns set up afterwards virtual datasets, joining the
+        same column of every shard. shards is a list of (path, nPoints), paths
+        relative to this file are resolved relative to its directory"""
+        self.shards = shards
+
+    def setupProperties(self, properties):
+        """runs the setup of every property name in properties,
+        e.g. ["Density", "Velocity"] calls setupDensity and setupVelocity"""
+        for name in properties:
+            getattr(self, f"setup{name}")()
+
+    @classmethod
+    def attributesForProperties(cls, properties):
+        """returns block attributes written by the setup of properties, with
+        the gridpoints of the position columns"""
+        attributes = ["gridpoints"]
+        for name in properties:
+            attributes += cls.propertyAttributes[name]
+        return attributes
 
     def setupDensity(self):
         self.setupPropertyDataset(self.createDensityDataset)
@@ -92,6 +271,19 @@ class LimeFile:
     def setupMagfield(self):
         self.setupPropertyDataset(self.createMagfieldDatasets)
 
+    def setupH2Density(self):
+        """writes the H2 number density derived from the H2 fraction of the
+        FLASH file into DENSITY1 instead of the total density"""
+        self.densityAttribute = "h2densities"
+        if self.densityDataset is None:
+            self.setupDensity()
+
+    def setupAbundance(self):
+        self.setupPropertyDataset(self.createAbundanceDataset)
+
+    def setupDoppler(self):
+        self.setupPropertyDataset(self.createDopplerDataset)
+
     def setupPropertyDataset(self, createFunction):
         """assumes setupPrimaryGroups called before"""
         if not self.gridColumnsGroup:
@@ -100,22 +292,64 @@ class LimeFile:
             )
         return createFunction()
 
-    def createIdDataset(self):
-        self.idDataset = self.file.create_dataset(
-            "GRID/columns/ID",
-            (self.nBlocks * self.gpPerBlock + self.nSinks),
-            dtype=np.uint32,
-            data=np.arange(self.nBlocks * self.gpPerBlock + self.nSinks),
+    def nPoints(self):
+        return self.nGridpoints + self.nSinks
+
+    def createColumnDataset(self, name, dtype, data=None, fillvalue=None):
+        """creates dataset GRID/columns/name of shape (nPoints,). Points never
+        written read as fillvalue without being stored"""
+        if self.shards is not None:
+            return self.createVirtualColumnDataset(name, dtype, fillvalue)
+        return self.file.create_dataset(
+            f"GRID/columns/{name}",
+            self.nPoints(),
+            dtype=dtype,
+            data=data,
+            fillvalue=fillvalue,
+            **self.storageOptions(),
         )
+
+    def storageOptions(self):
+        """returns create_dataset keywords for the configured storage"""
+        if self.layout == "contiguous" or self.nPoints() == 0:
+            return {}
+        return {
+            "chunks": (min(self.chunkBlocks * self.gpPerBlock, self.nPoints()),),
+            "compression": self.compression,
+            "shuffle": self.shuffle,
+        }
+
+    def createVirtualColumnDataset(self, name, dtype, fillvalue=None):
+        layout = h5py.VirtualLayout(shape=(self.nPoints(),), dtype=dtype)
+        iPoint = 0
+        for path, nPoints in self.shards:
+            layout[iPoint : iPoint + nPoints] = h5py.VirtualSource(
+                str(path), f"GRID/columns/{name}", shape=(nPoints,), dtype=dtype
+            )
+            iPoint += nPoints
+        return self.file.create_virtual_dataset(
+            f"GRID/columns/{name}", layout, fillvalue=fillvalue
+        )
+
+    def createIdDataset(self):
+        self.idDataset = self.createColumnDataset("ID", dtype=np.uint32)
+        if self.shards is None:
+            self.writeIds()
         self.idDataset.attrs.create("CLASS", "COLUMN", dtype=nulltermStringType(7))
         self.idDataset.attrs.create("COL_NAME", "ID", dtype=nulltermStringType(3))
         self.idDataset.attrs.create("UNIT", "", dtype=nulltermStringType(1))
 
+    def writeIds(self):
+        """writes the point IDs in pieces of generatedChunkPoints"""
+        for start in range(0, self.nPoints(), generatedChunkPoints):
+            stop = min(start + generatedChunkPoints, self.nPoints())
+            self.idDataset[start:stop] = np.arange(
+                self.firstPoint + start, self.firstPoint + stop, dtype=np.uint32
+            )
+
     def createSinkDataset(self):
-        self.sinkDataset = self.file.create_dataset(
-            "GRID/columns/IS_SINK",
-            (self.nBlocks * self.gpPerBlock + self.nSinks),
-            dtype=np.int16,
+        self.sinkDataset = self.createColumnDataset(
+            "IS_SINK", dtype=np.int16, fillvalue=0
         )
         self.idDataset.attrs.create("CLASS", "COLUMN", dtype=nulltermStringType(7))
         self.idDataset.attrs.create("COL_NAME", "IS_SINK", dtype=nulltermStringType(8))
@@ -133,13 +367,7 @@ class LimeFile:
     def create3DDatasetForNameAndUnit(self, dataset, name, unitName):
         """creates dataset of shape (len(blocks)* points/block + len(sinkpoints),)"""
         for i in range(1, 4):
-            dataset.append(
-                self.file.create_dataset(
-                    f"GRID/columns/{name}{i}",
-                    (self.nBlocks * self.gpPerBlock + self.nSinks),
-                    dtype=np.float64,
-                )
-            )
+            dataset.append(self.createColumnDataset(f"{name}{i}", dtype=np.float64))
             dataset[i - 1].attrs.create("CLASS", "COLUMN", dtype=nulltermStringType(7))
             dataset[i - 1].attrs.create(
                 "COL_NAME", f"{name}{i}", dtype=nulltermStringType(len(name) + 2)
@@ -149,11 +377,7 @@ class LimeFile:
             )
 
     def createDensityDataset(self):
-        self.densityDataset = self.file.create_dataset(
-            "GRID/columns/DENSITY1",
-            (self.nBlocks * self.gpPerBlock + self.nSinks),
-            dtype=np.float32,
-        )
+        self.densityDataset = self.createColumnDataset("DENSITY1", dtype=np.float32)
         self.densityDataset.attrs.create("CLASS", "COLUMN", dtype=nulltermStringType(7))
         self.densityDataset.attrs.create(
             "COL_NAME", "DENSITY1", dtype=nulltermStringType(9)
@@ -161,12 +385,8 @@ class LimeFile:
         self.densityDataset.attrs.create("UNIT", "kg/m^3", dtype=nulltermStringType(7))
 
     def createGasTemperatureDataset(self):
-        totalNumber = self.nBlocks * self.gpPerBlock + self.nSinks
-        self.gasTemperatureDataset = self.file.create_dataset(
-            "GRID/columns/TEMPKNTC",
-            totalNumber,
-            dtype=np.float32,
-            data=np.array([2.7548] * totalNumber),
+        self.gasTemperatureDataset = self.createColumnDataset(
+            "TEMPKNTC", dtype=np.float32, fillvalue=2.7548
         )
         self.gasTemperatureDataset.attrs.create(
             "CLASS", "COLUMN", dtype=nulltermStringType(7)
@@ -179,10 +399,8 @@ class LimeFile:
         )
 
     def createDustTemperatureDataset(self):
-        self.dustTemperatureDataset = self.file.create_dataset(
-            "GRID/columns/TEMPDUST",
-            (self.nBlocks * self.gpPerBlock + self.nSinks),
-            dtype=np.float32,
+        self.dustTemperatureDataset = self.createColumnDataset(
+            "TEMPDUST", dtype=np.float32
         )
         self.dustTemperatureDataset.attrs.create(
             "CLASS", "COLUMN", dtype=nulltermStringType(7)
@@ -194,88 +412,177 @@ class LimeFile:
             "UNIT", "K", dtype=nulltermStringType(2)
         )
 
-    def writeBlocks(self, blocks):
-        allGridpoints = self.nBlocks * self.gpPerBlock
+    def createAbundanceDataset(self):
+        self.abundanceDataset = self.createColumnDataset("ABUNMOL1", dtype=np.float32)
+        self.abundanceDataset.attrs.create(
+            "CLASS", "COLUMN", dtype=nulltermStringType(7)
+        )
+        self.abundanceDataset.attrs.create(
+            "COL_NAME", "ABUNMOL1", dtype=nulltermStringType(9)
+        )
+        self.abundanceDataset.attrs.create("UNIT", "", dtype=nulltermStringType(1))
 
-        iBlock = 0
+    def createDopplerDataset(self):
+        self.dopplerDataset = self.createColumnDataset("TURBDPLR", dtype=np.float32)
+        self.dopplerDataset.attrs.create("CLASS", "COLUMN", dtype=nulltermStringType(7))
+        self.dopplerDataset.attrs.create(
+            "COL_NAME", "TURBDPLR", dtype=nulltermStringType(9)
+        )
+        self.dopplerDataset.attrs.create("UNIT", "m/s", dtype=nulltermStringType(4))
+
+    def writeBlocks(
+        self,
+        blocks,
+        bufferBlocks=None,
+        bufferBytes=64 * 2**20,
+        firstBlock=0,
+        firstPoint=0,
+    ):
+        """writes FlashBlocks or FlashBlockBatches consecutively, starting
+        at block firstBlock and gridpoint firstPoint. Blocks are collected in
+        a ColumnBuffer of bufferBlocks blocks (or bufferBytes bytes) before
+        being written, progress is recorded after every write"""
+        columns = self.blockColumns()
+        if bufferBlocks is not None:
+            capacity = bufferBlocks * self.gpPerBlock
+        else:
+            bytesPerPoint = sum(dataset.dtype.itemsize for dataset, _, _ in columns)
+            capacity = max(bufferBytes // bytesPerPoint, self.gpPerBlock)
+
+        buffer = ColumnBuffer(
+            columns,
+            min(capacity, self.nGridpoints),
+            iPoint=firstPoint,
+            iBlock=firstBlock,
+            onWrite=self.recordProgress,
+        )
         for block in blocks:
-            # write position data
-            self.writeGridpointPositions(block, iBlock)
+            buffer.append(block)
+        buffer.flush()
+
+    def blockColumns(self):
+        """returns list of (dataset, block attribute, component) for all
+        datasets set up so far"""
+        columns = [
+            (dataset, "gridpoints", i)
+            for i, dataset in enumerate(self.positionDatasets)
+        ]
+        if self.densityDataset is not None:
+            columns.append((self.densityDataset, self.densityAttribute, None))
+        if self.gasTemperatureDataset is not None:
+            columns.append((self.gasTemperatureDataset, "temperatures", None))
+        if self.dustTemperatureDataset is not None:
+            columns.append((self.dustTemperatureDataset, "dusttemperatures", None))
+        if self.abundanceDataset is not None:
+            columns.append((self.abundanceDataset, "abundances", None))
+        if self.dopplerDataset is not None:
+            columns.append((self.dopplerDataset, "dopplerwidths", None))
+        for i, dataset in enumerate(self.velocityDatasets):
+            columns.append((dataset, "velocities", i))
+        for i, dataset in enumerate(self.magfieldDatasets):
+            columns.append((dataset, "magfluxes", i))
+        return columns
 
-            # write property data
-            self.writeDensities(block, iBlock)
-            self.writeGasTemperatures(block, iBlock)
-            self.writeDustTemperatures(block, iBlock)
-            self.writeVelocities(block, iBlock)
-            self.writeMagfield(block, iBlock)
+    def writeSinks(self, sinkpoints):
+        with stage("sinks"):
+            self.writeSinkColumns(sinkpoints)
+        sinkColumns = self.positionDatasets + [self.sinkDataset]
+        count("sinks", self.nSinks * sum(d.dtype.itemsize for d in sinkColumns))
 
-            iBlock += 1
+        if self.progressGroup is not None:
+            self.progressGroup.attrs["SINKS_DONE"] = 1
 
-    def writeSinks(self, sinkpoints):
+    def writeSinkColumns(self, sinkpoints):
         xSink, ySink, zSink = sinkpoints
-        allGridpoints = self.nBlocks * self.gpPerBlock
+        allGridpoints = self.nGridpoints
 
         # write sinkpoint positions
         self.positionDatasets[0][allGridpoints : allGridpoints + self.nSinks] = xSink
         self.positionDatasets[1][allGridpoints : allGridpoints + self.nSinks] = ySink
         self.positionDatasets[2][allGridpoints : allGridpoints + self.nSinks] = zSink
 
-        # write sinkpoint bitmask
-        self.sinkDataset[0:allGridpoints] = np.zeros(allGridpoints)
+        # write sinkpoint bitmask, gridpoints keep the fill value 0
         self.sinkDataset[allGridpoints:] = np.ones(self.nSinks)
 
-    def writeGridpointPositions(self, block, iBlock):
-        self.positionDatasets[0][
-            iBlock * self.gpPerBlock : (iBlock + 1) * self.gpPerBlock
-        ] = block.gridpoints[:, 0]
-        self.positionDatasets[1][
-            iBlock * self.gpPerBlock : (iBlock + 1) * self.gpPerBlock
-        ] = block.gridpoints[:, 1]
-        self.positionDatasets[2][
-            iBlock * self.gpPerBlock : (iBlock + 1) * self.gpPerBlock
-        ] = block.gridpoints[:, 2]
-
-    def writeDensities(self, block, iBlock):
-        if self.densityDataset is not None and block.densities is not None:
-            self.densityDataset[
-                iBlock * self.gpPerBlock : (iBlock + 1) * self.gpPerBlock
-            ] = block.densities[:]
-
-    def writeGasTemperatures(self, block, iBlock):
-        if self.gasTemperatureDataset is not None and block.temperatures is not None:
-            self.gasTemperatureDataset[
-                iBlock * self.gpPerBlock : (iBlock + 1) * self.gpPerBlock
-            ] = block.temperatures[:]
-
-    def writeDustTemperatures(self, block, iBlock):
-        if (
-            self.dustTemperatureDataset is not None
-            and block.dusttemperatures is not None
+
+def columnForBlock(block, attribute, component):
+    if hasattr(block, "column"):
+        # block batches hold contiguous columns and evaluate derived fields
+        return block.column(attribute, component)
+    values = getattr(block, attribute)
+    if values is None or component is None:
+        return values
+    return values[:, component]
+
+
+class ColumnBuffer:
+    """collects consecutive blocks in preallocated column buffers. On flush,
+    each column is written to its dataset as one contiguous hyperslab.
+    Properties a block does not provide are left untouched in the file"""
+
+    def __init__(self, columns, capacity, iPoint=0, iBlock=0, onWrite=None):
+        self.columns = columns
+        self.capacity = capacity
+        self.iPoint = iPoint  # file offset of first buffered point
+        self.iBlock = iBlock  # file offset of first buffered block
+        self.nPoints = 0
+        self.nBlocks = 0
+        self.onWrite = onWrite  # called with (iBlock, iPoint) after writes
+        self.buffers = [
+            np.empty(capacity, dtype=dataset.dtype) for dataset, _, _ in columns
+        ]
+        self.present = np.zeros((len(columns), capacity), dtype=bool)
+
+    def append(self, block):
+        nPoints = len(block.gridpoints)
+        if self.nPoints + nPoints > self.capacity:
+            self.flush()
+        if nPoints > self.capacity:
+            self.writeThrough(block, nPoints)
+            return
+        self.nBlocks += getattr(block, "nBlocks", 1)
+
+        points = slice(self.nPoints, self.nPoints + nPoints)
+        for (_, attribute, component), buffer, present in zip(
+            self.columns, self.buffers, self.present
         ):
-            self.dustTemperatureDataset[
-                iBlock * self.gpPerBlock : (iBlock + 1) * self.gpPerBlock
-            ] = block.dusttemperatures[:]
-
-    def writeVelocities(self, block, iBlock):
-        if len(self.velocityDatasets) > 0 and block.velocities is not None:
-            self.velocityDatasets[0][
-                iBlock * self.gpPerBlock : (iBlock + 1) * self.gpPerBlock
-            ] = block.velocities[:, 0]
-            self.velocityDatasets[1][
-                iBlock * self.gpPerBlock : (iBlock + 1) * self.gpPerBlock
-            ] = block.velocities[:, 1]
-            self.velocityDatasets[2][
-                iBlock * self.gpPerBlock : (iBlock + 1) * self.gpPerBlock
-            ] = block.velocities[:, 2]
-
-    def writeMagfield(self, block, iBlock):
-        if len(self.magfieldDatasets) > 0 and block.magfluxes is not None:
-            self.magfieldDatasets[0][
-                iBlock * self.gpPerBlock : (iBlock + 1) * self.gpPerBlock
-            ] = block.magfluxes[:, 0]
-            self.magfieldDatasets[1][
-                iBlock * self.gpPerBlock : (iBlock + 1) * self.gpPerBlock
-            ] = block.magfluxes[:, 1]
-            self.magfieldDatasets[2][
-                iBlock * self.gpPerBlock : (iBlock + 1) * self.gpPerBlock
-            ] = block.magfluxes[:, 2]
+            values = columnForBlock(block, attribute, component)
+            if values is not None:
+                buffer[points] = values
+                present[points] = True
+        self.nPoints += nPoints
+
+    def writeThrough(self, block, nPoints):
+        points = slice(self.iPoint, self.iPoint + nPoints)
+        nBytes = 0
+        with ioSlot(), stage("write"):
+            for dataset, attribute, component in self.columns:
+                values = columnForBlock(block, attribute, component)
+                if values is not None:
+                    dataset[points] = values
+                    nBytes += nPoints * dataset.dtype.itemsize
+        count("write", nBytes, getattr(block, "nBlocks", 1))
+        self.iPoint += nPoints
+        self.iBlock += getattr(block, "nBlocks", 1)
+        if self.onWrite is not None:
+            self.onWrite(self.iBlock, self.iPoint)
+
+    def flush(self):
+        nBytes = 0
+        with ioSlot(), stage("write"):
+            for (dataset, _, _), buffer, present in zip(
+                self.columns, self.buffers, self.present
+            ):
+                for start, stop in contiguousRuns(present[: self.nPoints]):
+                    dataset[self.iPoint + start : self.iPoint + stop] = buffer[
+                        start:stop
+                    ]
+                    nBytes += buffer[start:stop].nbytes
+        count("write", nBytes, self.nBlocks)
+        self.iPoint += self.nPoints
+        self.iBlock += self.nBlocks
+        self.nPoints = 0
+        self.nBlocks = 0
+        self.present[:] = False
+        if self.onWrite is not None:
+            self.onWrite(self.iBlock, self.iPoint)
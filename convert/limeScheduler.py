@@ -0,0 +1,222 @@
+import os
+import csv
+import sys
+import json
+import time
+import heapq
+import shlex
+import pathlib
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import h5py
+
+# the run time model is fitted and shared by analyze/limeScaling.py
+sys.path.append(str(pathlib.Path(__file__).absolute().parent.parent / "analyze"))
+from limeScaling import ScalingModel
+
+resultColumns = [
+    "input",
+    "threads",
+    "command",
+    "start",
+    "seconds",
+    "returncode",
+    "log",
+    "outDir",
+]
+
+
+class JobModel:
+    """estimated LIME run time of a job of nPoints points, given by the
+    ScalingModel of analyze/limeScaling.py. Models are read from the json
+    written by analyze/limeScaling.py --save"""
+
+    def __init__(self, overhead, serialT, parallelT, pointsPerBlock=512):
+        self.scalingModel = ScalingModel(overhead, serialT, parallelT, pointsPerBlock)
+
+    def time(self, nPoints, nThreads):
+        nBlocks = nPoints / self.scalingModel.pointsPerBlock
+        return self.scalingModel.time(nBlocks, nThreads)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as modelFile:
+            return cls(**json.load(modelFile))
+
+
+def pointsForInput(limeFilePath):
+    """returns the number of points of a LIME input file"""
+    with h5py.File(limeFilePath, "r") as limeFile:
+        return limeFile["GRID/columns/ID"].shape[0]
+
+
+def makespan(durations, nSlots):
+    """returns the time nSlots concurrent slots need for jobs of durations,
+    started longest first whenever a slot becomes free"""
+    slots = [0.0] * nSlots
+    for duration in sorted(durations, reverse=True):
+        heapq.heappush(slots, heapq.heappop(slots) + duration)
+    return max(slots)
+
+
+def planThreads(jobPoints, nCores, model):
+    """returns (threads per job, estimated makespan [s]) of the thread count
+    finishing jobs of jobPoints points earliest on nCores cores, running
+    nCores // threads jobs at a time"""
+    best = None
+    for nThreads in range(1, nCores + 1):
+        durations = [model.time(nPoints, nThreads) for nPoints in jobPoints]
+        estimate = makespan(durations, nCores // nThreads)
+        if best is None or estimate < best[1]:
+            best = (nThreads, estimate)
+    return best
+
+
+def runJob(inputPath, name, nThreads, commandTemplate, outDir):
+    """runs commandTemplate with {input}, {threads} and {outdir} filled in
+    for inputPath in job directory outDir/name, which also gets the log.
+    returns a result dict with keys resultColumns"""
+    jobDir = pathlib.Path(outDir) / name
+    jobDir.mkdir(parents=True, exist_ok=True)
+    logPath = jobDir / f"{name}.log"
+    command = commandTemplate.format(
+        input=shlex.quote(str(os.path.abspath(inputPath))),
+        threads=nThreads,
+        outdir=shlex.quote(str(jobDir.absolute())),
+    )
+
+    start = time.time()
+    with open(logPath, "w") as log:
+        completedProcess = subprocess.run(
+            command, shell=True, cwd=str(jobDir), stdout=log, stderr=subprocess.STDOUT
+        )
+    return {
+        "input": str(inputPath),
+        "threads": nThreads,
+        "command": command,
+        "start": start,
+        "seconds": time.time() - start,
+        "returncode": completedProcess.returncode,
+        "log": str(logPath),
+        "outDir": str(jobDir),
+    }
+
+
+def scheduleJobs(inputPaths, nCores, commandTemplate, outDir, resultsPath, threads):
+    """runs a LIME job for every input, packing nCores // threads jobs onto the
+    cores at a time, largest input first. Every finished job is appended to
+    csv file resultsPath. returns the result dicts"""
+    # job directories are numbered in input order, inputs may share names
+    jobs = sorted(
+        ((path, f"{i}_{pathlib.Path(path).stem}") for i, path in enumerate(inputPaths)),
+        key=lambda job: pointsForInput(job[0]),
+        reverse=True,
+    )
+    newFile = not pathlib.Path(resultsPath).exists()
+    with open(resultsPath, "a", newline="") as resultsFile:
+        writer = csv.DictWriter(resultsFile, fieldnames=resultColumns)
+        if newFile:
+            writer.writeheader()
+
+        results = []
+        with ThreadPoolExecutor(max_workers=max(1, nCores // threads)) as pool:
+            futures = [
+                pool.submit(runJob, path, name, threads, commandTemplate, outDir)
+                for path, name in jobs
+            ]
+            for future in as_completed(futures):
+                result = future.result()
+                writer.writerow(result)
+                resultsFile.flush()
+                results.append(result)
+
+    return results
+
+
+def createSchedulerArgumentParser():
+    arg_parser = argparse.ArgumentParser(
+        description="Runs LIME for many converted LIME input files, packing "
+        "the runs onto the cores of this node."
+    )
+    arg_parser.add_argument(
+        "outDir",
+        metavar="output directory",
+        type=str,
+        help="Directory of the job directories, logs and results",
+    )
+    arg_parser.add_argument(
+        "inFiles",
+        metavar="LIME file path",
+        type=str,
+        nargs="+",
+        help="LIME input files, one job each",
+    )
+    arg_parser.add_argument(
+        "-c",
+        "--cores",
+        type=int,
+        help="Cores to use, defaults to all cores of the node",
+    )
+    arg_parser.add_argument(
+        "--command",
+        type=str,
+        required=True,
+        help="Command of a job with placeholders {input}, {threads} and "
+        "{outdir}, run in the job directory. LIME reads a model.c naming the "
+        "grid file, so the command has to build LIME with a model for {input}",
+    )
+    threadChoice = arg_parser.add_mutually_exclusive_group()
+    threadChoice.add_argument(
+        "--model",
+        type=str,
+        help="Scaling model json of analyze/limeScaling.py, "
+        "used to choose the threads per job",
+    )
+    threadChoice.add_argument(
+        "-t", "--threads", type=int, help="Threads per job, defaults to 1"
+    )
+    arg_parser.add_argument(
+        "--results",
+        type=str,
+        help="csv file results are appended to, "
+        "defaults to results.csv in the output directory",
+    )
+
+    return arg_parser
+
+
+if __name__ == "__main__":
+    argParser = createSchedulerArgumentParser()
+    if len(sys.argv) < 2:
+        argParser.print_help()
+        exit()
+    args = argParser.parse_args()
+
+    nCores = args.cores if args.cores is not None else os.cpu_count()
+    threads = args.threads if args.threads is not None else 1
+    if args.model is not None:
+        jobPoints = [pointsForInput(path) for path in args.inFiles]
+        threads, estimate = planThreads(jobPoints, nCores, JobModel.load(args.model))
+        print(
+            f"running {nCores // threads} jobs of {threads} threads at a time, "
+            f"estimated {estimate:.0f} s"
+        )
+    threads = min(threads, nCores)
+
+    pathlib.Path(args.outDir).mkdir(parents=True, exist_ok=True)
+    results = scheduleJobs(
+        args.inFiles,
+        nCores,
+        args.command,
+        args.outDir,
+        args.results
+        if args.results is not None
+        else pathlib.Path(args.outDir) / "results.csv",
+        threads,
+    )
+    failed = [result for result in results if result["returncode"] != 0]
+    print(f"{len(results) - len(failed)} of {len(results)} jobs succeeded")
+    for result in failed:
+        print(f"failed: {result['input']}, see {result['log']}")
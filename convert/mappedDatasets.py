@@ -0,0 +1,30 @@
+import numpy as np
+
+
+def isMappable(dataset):
+    """returns True if the values of h5py dataset are stored in one piece,
+    uncompressed and in the file of the dataset itself"""
+    return (
+        dataset.file.driver == "sec2"
+        and dataset.chunks is None
+        and dataset.compression is None
+        and dataset.external is None
+        and not dataset.is_virtual
+        and dataset.dtype.kind in "biuf"
+        and dataset.id.get_offset() is not None
+    )
+
+
+def memmapForDataset(dataset):
+    """returns a read-only np.memmap of the values of h5py dataset, or the
+    dataset itself if it can not be mapped. Slices of the memmap are views
+    of the page cache, read without going through HDF5"""
+    if dataset is None or not isMappable(dataset):
+        return dataset
+    return np.memmap(
+        dataset.file.filename,
+        dtype=dataset.dtype,
+        mode="r",
+        offset=dataset.id.get_offset(),
+        shape=dataset.shape,
+    )
@@ -0,0 +1,160 @@
+import json
+import time
+import cProfile
+import resource
+import threading
+import contextlib
+import tracemalloc
+
+# recorder of the running conversion, None when metrics are not recorded
+recorder = None
+
+
+def peakMemoryMB(who=resource.RUSAGE_SELF):
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(who).ru_maxrss / 1024
+
+
+class MetricsRecorder:
+    """accumulates wall time, calls, bytes, blocks and peak memory per stage.
+    Stages running concurrently, e.g. in a BlockPipeline, overlap in time"""
+
+    def __init__(self, traceMemory=False):
+        self.stages = {}
+        self.lock = threading.Lock()
+        self.start = time.perf_counter()
+        self.traceMemory = traceMemory
+        self.stallTimes = None
+        if traceMemory:
+            tracemalloc.start()
+
+    def entry(self, name):
+        if name not in self.stages:
+            self.stages[name] = {
+                "seconds": 0.0,
+                "calls": 0,
+                "bytes": 0,
+                "blocks": 0,
+                "peakMemoryMB": 0.0,
+            }
+        return self.stages[name]
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            with self.lock:
+                entry = self.entry(name)
+                entry["seconds"] += seconds
+                entry["calls"] += 1
+                entry["peakMemoryMB"] = max(entry["peakMemoryMB"], peakMemoryMB())
+
+    def count(self, name, nBytes=0, nBlocks=0):
+        with self.lock:
+            entry = self.entry(name)
+            entry["bytes"] += nBytes
+            entry["blocks"] += nBlocks
+
+    def addStalls(self, stallTimes):
+        """adds BlockPipeline.stallTimes to the pipeline stalls of the report"""
+        with self.lock:
+            if self.stallTimes is None:
+                self.stallTimes = {
+                    stage: dict.fromkeys(sides, 0.0)
+                    for stage, sides in stallTimes.items()
+                }
+            for stage, sides in stallTimes.items():
+                for side, seconds in sides.items():
+                    self.stallTimes[stage][side] += seconds
+
+    def report(self):
+        """returns the recorded metrics as dict ready for json"""
+        stages = {}
+        for name, entry in self.stages.items():
+            stages[name] = dict(entry)
+            if entry["seconds"] > 0:
+                stages[name]["blocksPerSecond"] = entry["blocks"] / entry["seconds"]
+                stages[name]["MBPerSecond"] = (
+                    entry["bytes"] / 2**20 / entry["seconds"]
+                )
+        report = {
+            "wallSeconds": time.perf_counter() - self.start,
+            "peakMemoryMB": peakMemoryMB(),
+            "peakWorkerMemoryMB": peakMemoryMB(resource.RUSAGE_CHILDREN),
+            "stages": stages,
+        }
+        if self.stallTimes is not None:
+            report["pipelineStallSeconds"] = self.stallTimes
+        if self.traceMemory:
+            current, peak = tracemalloc.get_traced_memory()
+            report["tracedPeakMB"] = peak / 2**20
+            report["topAllocations"] = [
+                {"site": str(stat.traceback), "MB": stat.size / 2**20}
+                for stat in tracemalloc.take_snapshot().statistics("lineno")[:20]
+            ]
+        return report
+
+
+def nbytes(values):
+    """returns the bytes of the arrays in values, possibly nested in tuples
+    or dicts"""
+    if isinstance(values, dict):
+        return nbytes(tuple(values.values()))
+    if isinstance(values, tuple):
+        return sum(nbytes(value) for value in values)
+    return getattr(values, "nbytes", 0)
+
+
+@contextlib.contextmanager
+def stage(name):
+    """times the enclosed code as stage name of the running recorder"""
+    if recorder is None:
+        yield
+        return
+    with recorder.stage(name):
+        yield
+
+
+def count(name, nBytes=0, nBlocks=0):
+    """adds nBytes and nBlocks to stage name of the running recorder"""
+    if recorder is not None:
+        recorder.count(name, nBytes, nBlocks)
+
+
+def stalls(stallTimes):
+    """adds the stall times of a BlockPipeline to the running recorder"""
+    if recorder is not None:
+        recorder.addStalls(stallTimes)
+
+
+@contextlib.contextmanager
+def recording(metricsPath=None, profilePath=None, traceMemory=False):
+    """records stage metrics of the enclosed code into json file metricsPath
+    and cProfile statistics of the main thread into profilePath. traceMemory
+    adds the tracemalloc peak and top allocation sites to the metrics.
+    Without paths nothing is recorded"""
+    global recorder
+    if metricsPath is None and profilePath is None:
+        yield
+        return
+    recorder = MetricsRecorder(traceMemory and metricsPath is not None)
+    profile = cProfile.Profile() if profilePath is not None else None
+    try:
+        if profile is not None:
+            profile.enable()
+        yield
+        if profile is not None:
+            profile.disable()
+            profile.dump_stats(profilePath)
+        if metricsPath is not None:
+            with open(metricsPath, "w") as metricsFile:
+                json.dump(recorder.report(), metricsFile, indent=2)
+    finally:
+        if profile is not None:
+            profile.disable()
+        if recorder.traceMemory:
+            tracemalloc.stop()
+        recorder = None
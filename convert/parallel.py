@@ -0,0 +1,41 @@
+import collections
+import multiprocessing
+
+import h5py
+
+from flashBlock import FlashFactory
+
+# FlashFactory of the current worker process, opened by initWorker
+workerFactory = None
+
+
+def initWorker(flashFilePath, chunkCache, options):
+    global workerFactory
+    workerFactory = FlashFactory(h5py.File(flashFilePath, "r", **chunkCache), **options)
+
+
+def readBatch(leafRange):
+    start, stop = leafRange
+    return workerFactory.createBatch(workerFactory.leaves[start:stop])
+
+
+def generateBatchesInParallel(ff, blockslice, batchSize, nWorkers):
+    """yields FlashBlockBatches for leaves in blockslice in leaf order, like
+    ff.generateBlocksForSlice(blockslice, batchSize). Batches are read and
+    transformed by a pool of nWorkers processes, at most 2 * nWorkers
+    batches are kept in flight"""
+    leafRanges = ff.leafRangesForSlice(blockslice, batchSize)
+    maxPending = 2 * nWorkers
+
+    with multiprocessing.Pool(
+        nWorkers,
+        initializer=initWorker,
+        initargs=(ff.file.filename, ff.chunkCache(), ff.options),
+    ) as pool:
+        pending = collections.deque()
+        for leafRange in leafRanges:
+            pending.append(pool.apply_async(readBatch, (leafRange,)))
+            if len(pending) >= maxPending:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
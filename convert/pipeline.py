@@ -0,0 +1,106 @@
+import time
+import queue
+import threading
+
+from metrics import stalls
+
+# marks the end of the batches in a queue
+endOfBatches = object()
+
+
+class BlockPipeline:
+    """iterates over the FlashBlockBatches of blockslice like
+    ff.generateBlocksForSlice(blockslice, batchSize), reading and transforming
+    in two threads ahead of the consumer. Queues between the stages hold at
+    most depth batches. stallTimes records the seconds each stage waited for
+    its input or for room in its output queue, they are added to the running
+    metrics recorder when iteration ends"""
+
+    def __init__(self, ff, blockslice, batchSize, depth=2):
+        if depth < 1:
+            raise ValueError(f"Pipeline depth must be at least 1, not {depth}.")
+        self.ff = ff
+        self.blockslice = blockslice
+        self.batchSize = batchSize
+        self.depth = depth
+        self.stop = threading.Event()
+        self.stallTimes = {
+            "read": {"output": 0.0},
+            "transform": {"input": 0.0, "output": 0.0},
+            "write": {"input": 0.0},
+        }
+
+    def __iter__(self):
+        readQueue = queue.Queue(self.depth)
+        transformQueue = queue.Queue(self.depth)
+        threads = [
+            threading.Thread(target=self.read, args=(readQueue,), daemon=True),
+            threading.Thread(
+                target=self.transform, args=(readQueue, transformQueue), daemon=True
+            ),
+        ]
+        for thread in threads:
+            thread.start()
+
+        try:
+            while True:
+                item = self.get(transformQueue, "write")
+                if item is endOfBatches:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            self.stop.set()
+            for thread in threads:
+                thread.join()
+            stalls(self.stallTimes)
+
+    def read(self, readQueue):
+        try:
+            for start, stop in self.ff.leafRangesForSlice(
+                self.blockslice, self.batchSize
+            ):
+                if self.stop.is_set():
+                    return
+                blockIds = self.ff.leaves[start:stop]
+                self.put(readQueue, (blockIds, self.ff.readBatch(blockIds)), "read")
+            self.put(readQueue, endOfBatches, "read")
+        except Exception as exception:
+            self.put(readQueue, exception, "read")
+
+    def transform(self, readQueue, transformQueue):
+        try:
+            while not self.stop.is_set():
+                item = self.get(readQueue, "transform")
+                if item is endOfBatches or isinstance(item, BaseException):
+                    self.put(transformQueue, item, "transform")
+                    return
+                blockIds, values = item
+                batch = self.ff.transformBatch(blockIds, values)
+                self.put(transformQueue, batch, "transform")
+        except Exception as exception:
+            self.put(transformQueue, exception, "transform")
+
+    def get(self, fromQueue, stage):
+        start = time.perf_counter()
+        while True:
+            try:
+                item = fromQueue.get(timeout=0.1)
+                break
+            except queue.Empty:
+                if self.stop.is_set():
+                    item = endOfBatches
+                    break
+        self.stallTimes[stage]["input"] += time.perf_counter() - start
+        return item
+
+    def put(self, toQueue, item, stage):
+        start = time.perf_counter()
+        while not self.stop.is_set():
+            try:
+                toQueue.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                pass
+        self.stallTimes[stage]["output"] += time.perf_counter() - start
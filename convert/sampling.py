@@ -0,0 +1,76 @@
+import numpy as np
+
+# block attributes carried over to sampled points
+pointProperties = [
+    "gridpoints",
+    "temperatures",
+    "dusttemperatures",
+    "densities",
+    "velocities",
+    "magfluxes",
+]
+
+
+class SampledPoints:
+    """gridpoints selected by a PointSampler, with the same attributes as a
+    FlashBlockBatch so LimeFile.writeBlocks can write them"""
+
+    def __init__(self, columns):
+        for name in pointProperties:
+            setattr(self, name, columns.get(name))
+
+
+class PointSampler:
+    """streaming weighted sampling of nPoints gridpoints without replacement
+    (Efraimidis & Spirakis 2006). Every point gets the key log(u) / weight
+    with u uniform in [0,1), the nPoints largest keys are kept. weight is
+    abs(block.<field>) ** power. Only the current sample is held in memory"""
+
+    def __init__(self, nPoints, field="densities", power=1.0):
+        self.nPoints = nPoints
+        self.field = field
+        self.power = power
+        self.nSeen = 0
+        self.keys = np.empty(0)
+        self.positions = np.empty(0, dtype=np.int64)  # position in stream
+        self.columns = {}
+
+    def add(self, block):
+        if hasattr(block, "column"):
+            # block batches evaluate derived and extra fields
+            weights = np.abs(block.column(self.field)) ** self.power
+        else:
+            weights = np.abs(getattr(block, self.field)) ** self.power
+        with np.errstate(divide="ignore"):
+            keys = np.log(np.random.random(len(weights))) / weights
+        positions = np.arange(self.nSeen, self.nSeen + len(weights))
+        self.nSeen += len(weights)
+
+        # only points beating the smallest kept key can enter a full sample
+        if len(self.keys) == self.nPoints:
+            candidates = np.flatnonzero(keys > self.keys.min())
+        else:
+            candidates = np.arange(len(keys))
+
+        self.keys = np.concatenate((self.keys, keys[candidates]))
+        self.positions = np.concatenate((self.positions, positions[candidates]))
+        for name in pointProperties:
+            values = getattr(block, name)
+            if values is None:
+                continue
+            kept = self.columns.get(name, values[:0])
+            self.columns[name] = np.concatenate((kept, values[candidates]))
+
+        if len(self.keys) > self.nPoints:
+            self.keep(np.argpartition(self.keys, -self.nPoints)[-self.nPoints :])
+
+    def keep(self, selection):
+        self.keys = self.keys[selection]
+        self.positions = self.positions[selection]
+        for name, values in self.columns.items():
+            self.columns[name] = values[selection]
+
+    def sample(self):
+        """returns SampledPoints in the order they were streamed in"""
+        self.keep(np.argsort(self.positions))
+        return SampledPoints(self.columns)
@@ -0,0 +1,82 @@
+import sys
+import pathlib
+import argparse
+
+import h5py
+
+from convert import convertWithArgs
+from flashMetadata import geometryDigest
+from helper import addConversionArguments, outFileForFlashFile, metricsForOutFile
+
+
+def createSeriesArgumentParser():
+    arg_parser = argparse.ArgumentParser(
+        description="Converts a time series of FLASH files to LIME input, "
+        "reusing ID, position and IS_SINK columns while the mesh is unchanged.",
+    )
+    arg_parser.add_argument(
+        "outDir", metavar="LIME directory", type=str, help="Directory of LIME files"
+    )
+    arg_parser.add_argument(
+        "inFiles",
+        metavar="FLASH file path",
+        type=str,
+        nargs="+",
+        help="Paths of FLASH files, converted in sorted order",
+    )
+    arg_parser.add_argument(
+        "--reuse",
+        choices=["link", "copy"],
+        help="Reuse geometry columns as external links to or copies of the last "
+        "LIME file on the same mesh. Defaults to link",
+    )
+    addConversionArguments(arg_parser)
+
+    return arg_parser
+
+
+def convertSeriesWithArgs(args):
+    """converts every FLASH file of args.inFiles into args.outDir. Files on
+    the same mesh as the previous one only get their property columns
+    written. returns list of (FLASH file, LIME file, reused geometry)"""
+    copyGeometry = args.reuse == "copy"
+    pathlib.Path(args.outDir).mkdir(parents=True, exist_ok=True)
+
+    results = []
+    geometryFile = None
+    previousDigest = None
+    for flashFilePath in sorted(args.inFiles):
+        outFile = outFileForFlashFile(args.outDir, flashFilePath)
+        with h5py.File(flashFilePath, "r") as flashFile:
+            digest = geometryDigest(flashFile)
+
+        fileArgs = argparse.Namespace(
+            **{
+                **vars(args),
+                "inFile": flashFilePath,
+                "outFile": str(outFile),
+                **metricsForOutFile(args, outFile),
+            }
+        )
+        reused = digest == previousDigest
+        if reused:
+            convertWithArgs(fileArgs, geometryFile, copyGeometry)
+        else:
+            convertWithArgs(fileArgs)
+            geometryFile = str(outFile)
+            previousDigest = digest
+
+        results.append((flashFilePath, str(outFile), reused))
+
+    return results
+
+
+if __name__ == "__main__":
+    argParser = createSeriesArgumentParser()
+
+    if len(sys.argv) < 2:
+        argParser.print_help()
+        exit()
+
+    for flashFilePath, outFile, reused in convertSeriesWithArgs(argParser.parse_args()):
+        print(f"{flashFilePath} -> {outFile}{' (reused geometry)' if reused else ''}")
@@ -0,0 +1,108 @@
+import pathlib
+import multiprocessing
+
+import h5py
+
+from flashBlock import FlashFactory
+from limeFile import LimeFile
+
+
+def shardDirForOutFile(outFile):
+    outFile = pathlib.Path(outFile)
+    return outFile.parent / f"{outFile.stem}_shards"
+
+
+def writeBlockShard(task):
+    """writes leaves [start, stop) of the FLASH file into their own LimeFile"""
+    (
+        shardPath,
+        flashFilePath,
+        chunkCache,
+        factoryOptions,
+        start,
+        stop,
+        firstPoint,
+        properties,
+        batchSize,
+        storage,
+    ) = task
+    ff = FlashFactory(h5py.File(flashFilePath, "r", **chunkCache), **factoryOptions)
+
+    with LimeFile(str(shardPath), "w") as shard:
+        shard.setupPrimaryGroups()
+        shard.setupStorage(**storage)
+        shard.setupPoints(
+            nBlocks=stop - start,
+            firstPoint=firstPoint,
+            nGridpoints=ff.gridpointsForSlice(slice(start, stop)),
+        )
+        shard.setupProperties(properties)
+        shard.writeBlocks(
+            ff.generateBlocksForSlice(slice(start, stop), batchSize, reuse=True)
+        )
+
+    return shard.nPoints()
+
+
+def writeSinkShard(shardPath, sinkpoints, firstPoint, properties, storage):
+    with LimeFile(str(shardPath), "w") as shard:
+        shard.setupPrimaryGroups()
+        shard.setupStorage(**storage)
+        shard.setupPoints(nBlocks=0, nSinks=sinkpoints.shape[1], firstPoint=firstPoint)
+        shard.setupProperties(properties)
+        shard.writeSinks(sinkpoints)
+
+    return shard.nPoints()
+
+
+def writeShards(
+    ff, outFile, nBlocks, sinkpoints, properties, batchSize, nShards, storage
+):
+    """writes the first nBlocks leaves split into nShards block shards, written
+    in parallel, plus one shard for sinkpoints. storage holds the keywords
+    of LimeFile.setupStorage for all shards. Shards are placed in a
+    directory next to outFile. returns list of (path, nPoints) relative to the
+    directory of outFile, as needed by LimeFile.setupShards"""
+    outDir = pathlib.Path(outFile).parent
+    shardDir = shardDirForOutFile(outFile)
+    shardDir.mkdir(exist_ok=True)
+
+    blocksPerShard = -(-nBlocks // nShards)
+    tasks = []
+    for iShard, start in enumerate(range(0, nBlocks, blocksPerShard)):
+        stop = min(start + blocksPerShard, nBlocks)
+        tasks.append(
+            (
+                shardDir / f"shard_{iShard:04d}.h5",
+                ff.file.filename,
+                ff.chunkCache(),
+                ff.options,
+                start,
+                stop,
+                ff.gridpointsForSlice(slice(0, start)),
+                properties,
+                batchSize,
+                storage,
+            )
+        )
+
+    with multiprocessing.Pool(max(min(nShards, len(tasks)), 1)) as pool:
+        shardPoints = pool.map(writeBlockShard, tasks)
+    shardPaths = [task[0] for task in tasks]
+
+    sinkShardPath = shardDir / "shard_sinks.h5"
+    shardPoints.append(
+        writeSinkShard(
+            sinkShardPath,
+            sinkpoints,
+            ff.gridpointsForSlice(slice(0, nBlocks)),
+            properties,
+            storage,
+        )
+    )
+    shardPaths.append(sinkShardPath)
+
+    return [
+        (path.relative_to(outDir), nPoints)
+        for path, nPoints in zip(shardPaths, shardPoints)
+    ]
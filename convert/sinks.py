@@ -0,0 +1,57 @@
+import numpy as np
+
+# golden angle [rad], azimuth increment between consecutive lattice points
+goldenAngle = np.pi * (3 - np.sqrt(5))
+
+
+def randomSphereSurface(npoints, rng=np.random):
+    """returns np.array of shape (3, npoints) of points randomly placed on the
+    surface of the unit sphere. rng is a np.random.Generator or np.random"""
+    vec = rng.standard_normal((3, npoints))
+    vec /= np.linalg.norm(vec, axis=0)
+    return vec
+
+
+def randomSphereVolume(npoints, rng=np.random):
+    """returns np.array of shape (3, npoints) of points randomly placed in the
+    volume of the unit sphere. rng is a np.random.Generator or np.random"""
+    phi = rng.uniform(0, 2 * np.pi, npoints)
+    theta = np.arccos(rng.uniform(-1, 1, npoints))
+    r = rng.uniform(0, 1, npoints) ** (1 / 3)
+    return np.array(
+        [
+            r * np.sin(theta) * np.cos(phi),
+            r * np.sin(theta) * np.sin(phi),
+            r * np.cos(theta),
+        ]
+    )
+
+
+def fibonacciSphere(npoints):
+    """returns np.array of shape (3, npoints) of points on the surface of the
+    unit sphere on a Fibonacci lattice, every point covering about the same
+    area"""
+    z = 1 - (2 * np.arange(npoints) + 1) / npoints
+    rho = np.sqrt(1 - z**2)
+    phi = goldenAngle * np.arange(npoints)
+    return np.array([rho * np.cos(phi), rho * np.sin(phi), z])
+
+
+def sinkCountForRadius(radius, minscale, spacing=32, minSinks=12, maxSinks=10**5):
+    """returns the number of sinks on a sphere of radius that are spacing
+    times minscale apart when packed hexagonally, within [minSinks, maxSinks]"""
+    distance = spacing * minscale
+    nSinks = int(np.ceil(4 * np.pi * radius**2 / (np.sqrt(3) / 2 * distance**2)))
+    return min(max(nSinks, minSinks), maxSinks)
+
+
+def sinkpointsForMode(nSinks, mode="random", seed=None):
+    """returns np.array of shape (3, nSinks) of sinks on the unit sphere,
+    placed randomly or on a Fibonacci lattice (mode "lattice"). Random sinks
+    use np.random unless a seed is given"""
+    if mode == "lattice":
+        return fibonacciSphere(nSinks)
+    if mode != "random":
+        raise ValueError(f"Unknown sink mode {mode}, use random or lattice.")
+    rng = np.random.default_rng(seed) if seed is not None else np.random
+    return randomSphereSurface(nSinks, rng)
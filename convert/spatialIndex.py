@@ -0,0 +1,93 @@
+import numpy as np
+
+
+def mortonCodes(points, lower, upper, bits=10):
+    """returns Z-order curve position of points of shape (n,3) inside the box
+    [lower, upper], quantized to 2^bits cells per axis"""
+    cells = (points - lower) / np.maximum(upper - lower, np.finfo(float).tiny)
+    cells = np.clip((cells * 2**bits).astype(np.int64), 0, 2**bits - 1)
+
+    codes = np.zeros(len(points), dtype=np.int64)
+    for bit in range(bits):
+        for axis in range(3):
+            codes |= ((cells[:, axis] >> bit) & 1) << (3 * bit + axis)
+    return codes
+
+
+def boxesIntersectBox(lo, hi, lower, upper):
+    return np.all((lo <= upper) & (hi >= lower), axis=1)
+
+
+def boxesIntersectSphere(lo, hi, center, radius):
+    nearest = np.clip(center, lo, hi)
+    return np.sum((nearest - center) ** 2, axis=1) <= radius**2
+
+
+def boxesIntersectCone(lo, hi, apex, direction, halfAngle, length=np.inf):
+    """conservative test on the bounding spheres of the boxes, may include
+    boxes close to but outside the cone. halfAngle in radians"""
+    centers = (lo + hi) / 2
+    radii = np.linalg.norm(hi - lo, axis=1) / 2
+    toCenters = centers - apex
+    along = toCenters @ direction
+    across = np.linalg.norm(toCenters - along[:, np.newaxis] * direction, axis=1)
+
+    outside = across * np.cos(halfAngle) - along * np.sin(halfAngle)
+    return (outside <= radii) & (along <= length + radii) & (along >= -radii)
+
+
+class LeafIndex:
+    """spatial index over leaf boundingboxes: a two level bounding volume
+    hierarchy. Leaves are sorted along a Z-order curve and grouped in nodes
+    of nodeSize leaves. Queries test the node boxes first and only the
+    leaves of intersecting nodes afterwards"""
+
+    def __init__(self, leaves, bbs, nodeSize=64):
+        lo, hi = bbs[leaves, :, 0], bbs[leaves, :, 1]
+        order = np.argsort(
+            mortonCodes((lo + hi) / 2, np.min(lo, axis=0), np.max(hi, axis=0))
+        )
+        self.leaves = leaves[order]
+        self.lo = lo[order]
+        self.hi = hi[order]
+
+        self.nodeStarts = np.arange(0, len(self.leaves), nodeSize)
+        self.nodeLo = np.minimum.reduceat(self.lo, self.nodeStarts, axis=0)
+        self.nodeHi = np.maximum.reduceat(self.hi, self.nodeStarts, axis=0)
+
+    def query(self, intersect, *args):
+        """returns sorted ids of leaves for which intersect(lo, hi, *args)"""
+        if len(self.leaves) == 0:
+            return self.leaves
+
+        hitNodes = np.flatnonzero(intersect(self.nodeLo, self.nodeHi, *args))
+        nodeStops = np.append(self.nodeStarts[1:], len(self.leaves))
+        candidates = np.concatenate(
+            [np.arange(self.nodeStarts[i], nodeStops[i]) for i in hitNodes]
+            + [np.empty(0, dtype=np.int64)]
+        )
+        hits = intersect(self.lo[candidates], self.hi[candidates], *args)
+        return np.sort(self.leaves[candidates[hits]])
+
+    def sphere(self, center, radius):
+        return self.query(boxesIntersectSphere, np.asarray(center), radius)
+
+    def box(self, lower, upper):
+        return self.query(boxesIntersectBox, np.asarray(lower), np.asarray(upper))
+
+    def cone(self, apex, direction, halfAngle, length=np.inf):
+        """halfAngle in degrees, cone extends length along direction"""
+        direction = np.asarray(direction, dtype=float)
+        return self.query(
+            boxesIntersectCone,
+            np.asarray(apex),
+            direction / np.linalg.norm(direction),
+            np.radians(halfAngle),
+            length,
+        )
+
+    def region(self, region):
+        """queries region given as (shape, arguments), e.g.
+        ("sphere", ((0, 0, 0), 1e18))"""
+        shape, arguments = region
+        return getattr(self, shape)(*arguments)
@@ -0,0 +1,67 @@
+import os
+import sys
+import time
+import pathlib
+
+import h5py
+
+from helper import createArgumentParser
+from convert import convertWithArgs
+
+# name: extra converter arguments
+storagePolicies = {
+    "contiguous": [],
+    "chunked": ["--storage", "chunked"],
+    "gzip": ["--storage", "gzip"],
+    "gzip+shuffle": ["--storage", "gzip", "--shuffle"],
+    "lzf": ["--storage", "lzf"],
+    "lzf+shuffle": ["--storage", "lzf", "--shuffle"],
+}
+
+
+def readColumns(limeFilePath):
+    """reads every grid column completely, like LIME does on startup"""
+    with h5py.File(limeFilePath, "r") as limeFile:
+        for dataset in limeFile["GRID/columns"].values():
+            dataset[()]
+
+
+def benchmarkStoragePolicies(flashFilePath, outDir, extraArgs=()):
+    """converts flashFilePath with every storage policy and returns list of
+    (policy, write time [s], file size [bytes], read time [s])"""
+    parser = createArgumentParser()
+    results = []
+
+    for policy, policyArgs in storagePolicies.items():
+        outFile = pathlib.Path(outDir) / f"storage_{policy}.h5"
+        args = parser.parse_args(
+            [str(flashFilePath), str(outFile), *policyArgs, *extraArgs]
+        )
+
+        writeStart = time.time()
+        convertWithArgs(args)
+        writeT = time.time() - writeStart
+
+        readStart = time.time()
+        readColumns(outFile)
+        readT = time.time() - readStart
+
+        results.append((policy, writeT, os.path.getsize(outFile), readT))
+
+    return results
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print(
+            f"usage: {sys.argv[0]} FLASH_FILE OUT_DIR [converter arguments]\n"
+            "converts FLASH_FILE with every storage policy, reports write time, "
+            "file size and read time"
+        )
+        exit()
+
+    print(f"{'policy':<14}{'write [s]':>12}{'size [MB]':>12}{'read [s]':>12}")
+    for policy, writeT, size, readT in benchmarkStoragePolicies(
+        sys.argv[1], sys.argv[2], sys.argv[3:]
+    ):
+        print(f"{policy:<14}{writeT:>12.3f}{size / 2**20:>12.2f}{readT:>12.3f}")
@@ -0,0 +1,165 @@
+import sys
+import argparse
+
+import h5py
+import numpy as np
+
+# all unknowns FlashFactory reads, dens is always written
+allFields = ["dens", "temp", "tdus", "velx", "vely", "velz", "magx", "magy", "magz"]
+
+# blocks whose values are generated at once
+generatedChunkBlocks = 1024
+
+
+def refineTree(nLeaves, maxLevel, rng):
+    """refines randomly chosen leaves of a single root block on levels below
+    maxLevel until there are at least nLeaves leaves. returns lists of the
+    lower corners (in units of the root block size), levels and children of
+    all blocks in FLASH (depth first) order"""
+    if nLeaves > 8 ** (maxLevel - 1):
+        raise ValueError(
+            f"{nLeaves} leaves do not fit into {maxLevel} refinement levels."
+        )
+    corners = [np.zeros(3)]
+    levels = [1]
+    children = [[]]
+    refinable = [0] if maxLevel > 1 else []
+    leafCount = 1
+    while leafCount < nLeaves:
+        parent = refinable.pop(rng.integers(len(refinable)))
+        size = 0.5 ** levels[parent]
+        for child in range(8):
+            offset = np.array([(child >> axis) & 1 for axis in range(3)])
+            children[parent].append(len(corners))
+            if levels[parent] + 1 < maxLevel:
+                refinable.append(len(corners))
+            corners.append(corners[parent] + offset * size)
+            levels.append(levels[parent] + 1)
+            children.append([])
+        leafCount += 7
+
+    order = []
+    stack = [0]
+    while stack:
+        block = stack.pop()
+        order.append(block)
+        stack.extend(reversed(children[block]))
+    position = np.empty(len(order), dtype=int)
+    position[order] = np.arange(len(order))
+
+    return (
+        np.array(corners)[order],
+        np.array(levels)[order],
+        [[position[child] for child in children[block]] for block in order],
+    )
+
+
+def fieldValues(field, shape, rng, dtype):
+    """returns plausible values of FLASH unknown field in cgs units"""
+    if field == "dens":
+        return np.exp(rng.normal(np.log(1e-20), 1.0, shape)).astype(dtype)
+    if field == "temp":
+        return rng.uniform(10, 50, shape).astype(dtype)
+    if field == "tdus":
+        return rng.uniform(10, 20, shape).astype(dtype)
+    if field.startswith("vel"):
+        return rng.normal(0, 1e5, shape).astype(dtype)
+    return rng.normal(0, 1e-5, shape).astype(dtype)
+
+
+def writeSyntheticFlashFile(
+    path,
+    nLeaves,
+    maxLevel=4,
+    blockShape=(8, 8, 8),
+    fields=allFields,
+    domainSize=3.086e18,
+    seed=0,
+    dtype=np.float32,
+):
+    """writes a FLASH file with an octree of at least nLeaves leaf blocks on
+    up to maxLevel refinement levels, centered on the origin. Every block
+    holds blockShape cells of random but plausible values of fields. Blocks
+    must be cubic, the converter takes the cells of non-cubic blocks to be
+    in FLASH (nz, ny, nx) order. returns the number of leaves, a multiple of
+    7 plus 1"""
+    if len(set(blockShape)) != 1:
+        raise ValueError(f"Blocks must be cubic, not {tuple(blockShape)}.")
+    rng = np.random.default_rng(seed)
+    corners, levels, children = refineTree(nLeaves, maxLevel, rng)
+    nBlocks = len(levels)
+    sizes = domainSize * 0.5 ** (levels - 1)
+    lower = corners * domainSize - domainSize / 2
+    fields = sorted(set(fields) | {"dens"})
+
+    with h5py.File(path, "w") as flashFile:
+        flashFile["bounding box"] = np.stack(
+            [lower, lower + sizes[:, np.newaxis]], axis=-1
+        )
+        flashFile["block size"] = np.repeat(sizes[:, np.newaxis], 3, axis=1)
+        flashFile["refine level"] = levels.astype(np.int32)
+        flashFile["node type"] = np.where(
+            [len(blockChildren) == 0 for blockChildren in children], 1, 2
+        ).astype(np.int32)
+
+        for field in fields:
+            dataset = flashFile.create_dataset(
+                field, (nBlocks, *blockShape), dtype=dtype
+            )
+            for start in range(0, nBlocks, generatedChunkBlocks):
+                stop = min(start + generatedChunkBlocks, nBlocks)
+                dataset[start:stop] = fieldValues(
+                    field, (stop - start, *blockShape), rng, dtype
+                )
+
+    return int(np.sum([len(blockChildren) == 0 for blockChildren in children]))
+
+
+def createSyntheticArgumentParser():
+    arg_parser = argparse.ArgumentParser(
+        description="Writes a synthetic FLASH file for testing and benchmarking "
+        "the converter."
+    )
+    arg_parser.add_argument(
+        "outFile", metavar="FLASH file path", type=str, help="Path of FLASH file"
+    )
+    arg_parser.add_argument(
+        "-l", "--leaves", type=int, help="Minimal number of leaf blocks"
+    )
+    arg_parser.add_argument(
+        "-d", "--depth", type=int, help="Number of refinement levels, defaults to 4"
+    )
+    arg_parser.add_argument(
+        "--blockshape",
+        type=int,
+        nargs=3,
+        metavar=("NX", "NY", "NZ"),
+        help="Cells per block, defaults to 8 8 8. Blocks must be cubic",
+    )
+    arg_parser.add_argument(
+        "--fields",
+        nargs="+",
+        choices=allFields,
+        help="Unknowns to write, defaults to all. dens is always written",
+    )
+    arg_parser.add_argument("--seed", type=int, help="Random seed")
+
+    return arg_parser
+
+
+if __name__ == "__main__":
+    argParser = createSyntheticArgumentParser()
+    if len(sys.argv) < 2:
+        argParser.print_help()
+        exit()
+    args = argParser.parse_args()
+
+    nLeaves = writeSyntheticFlashFile(
+        args.outFile,
+        args.leaves if args.leaves is not None else 512,
+        maxLevel=args.depth if args.depth is not None else 4,
+        blockShape=tuple(args.blockshape) if args.blockshape else (8, 8, 8),
+        fields=args.fields if args.fields is not None else allFields,
+        seed=args.seed if args.seed is not None else 0,
+    )
+    print(f"wrote {nLeaves} leaves to {args.outFile}")
@@ -1,13 +1,16 @@
+import sys
 import time
 import pathlib
+import resource
 import argparse
+import importlib.util
 import subprocess
 
 import csv
 import h5py
 import numpy as np
 
-from flashBlock import FlashFactory
+from flashBlock import FlashFactory, FlashBlockBatch
 from helper import (
     centerAxis,
     sampleSphereSurface,
@@ -15,7 +18,11 @@ from helper import (
     sampleSphere,
     createArgumentParser,
 )
-from limeFile import LimeFile
+from ioGate import setIoSemaphore
+from limeFile import LimeFile, progressForFile
+from limeScheduler import scheduleJobs, JobModel
+from mappedDatasets import memmapForDataset
+from syntheticFlash import writeSyntheticFlashFile
 
 from convert import convertWithArgs
 
@@ -148,6 +155,247 @@ def threeBlocksTest():
         limeFile.writeSinks(sinkpoints)
 
 
+def writeConstantMemoryColumns(outFile, nBlocks):
+    """writes ID, IS_SINK and TEMPKNTC of nBlocks blocks to outFile. returns
+    the peak resident memory of the process before and after in kilobytes"""
+    # ru_maxrss is in kilobytes on Linux
+    peakBefore = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    with LimeFile(f"{str(outFile)}", "w") as limeFile:
+        limeFile.setupFileAttributes()
+        limeFile.setupPrimaryGroups()
+        limeFile.setupPoints(nBlocks=nBlocks, nSinks=1000)
+        limeFile.setupProperties(["GasTemperature"])
+        limeFile.writeSinks(sampleSphereSurface(1000))
+    peakAfter = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return peakBefore, peakAfter
+
+
+def constantMemoryColumnsTest():
+    """ID, IS_SINK and TEMPKNTC of a 10^8 point grid must not raise the peak
+    resident memory by more than the ceiling. They are written in a fresh
+    process, whose peak is not that of earlier tests"""
+    testDir = pathlib.Path(__file__).parent.absolute() / "tests"
+    outFile = testDir.joinpath("out/constant_memory_test.h5")
+    nBlocks = 200000
+    ceilingMB = 128
+
+    completedProcess = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import tests; "
+            f"print(*tests.writeConstantMemoryColumns({str(outFile)!r}, {nBlocks}))",
+        ],
+        cwd=str(pathlib.Path(__file__).parent.absolute()),
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    peakBefore, peakAfter = map(int, completedProcess.stdout.split()[-2:])
+
+    increaseMB = (peakAfter - peakBefore) / 1024
+    print(f"peak memory increase: {increaseMB:.1f} MB")
+    assert increaseMB < ceilingMB
+
+
+def limeSchedulerTest():
+    """schedules a stub in place of LIME, which fails for one input"""
+    testDir = pathlib.Path(__file__).parent.absolute() / "tests"
+    flashFile = testDir.joinpath("out/scheduler_test_flash.h5")
+    inFile = testDir.joinpath("out/scheduler_test.h5")
+    writeSyntheticFlashFile(str(flashFile), 64, seed=4)
+    convertWithArgs(
+        createArgumentParser().parse_args([str(flashFile), str(inFile), "-s", "10"])
+    )
+    outDir = testDir.joinpath("out/scheduler")
+    resultsFile = outDir.joinpath("results.csv")
+    outDir.mkdir(parents=True, exist_ok=True)
+    resultsFile.unlink(missing_ok=True)
+
+    results = scheduleJobs(
+        [str(inFile)] * 4,
+        4,
+        "echo {threads} {input}; test $(basename {outdir}) != 1_scheduler_test",
+        str(outDir),
+        str(resultsFile),
+        2,
+    )
+    assert sorted(result["returncode"] for result in results) == [0, 0, 0, 1]
+    with open(str(resultsFile), newline="") as csvFile:
+        assert len(list(csv.DictReader(csvFile))) == 4
+
+
+def derivedFieldsTest():
+    """derived fields of a batch of two blocks with known H2 and CO fractions
+    and one block of uniform velocity"""
+    gpIndices = np.indices((8, 8, 8))
+    bbs = np.tile([[0.0, 1.0], [0.0, 1.0], [0.0, 1.0]], (2, 1, 1))
+    values = np.ones((2, 8, 8, 8), dtype=np.float32)
+    vels = (values * np.arange(2)[:, None, None, None] * np.indices((8, 8, 8))[0],)
+    extras = {"ih2": values * 0.5, "ico": values * 1e-3}
+    batch = FlashBlockBatch(
+        np.arange(2), gpIndices, bbs, values, None, values, vels * 3, None, extras
+    )
+
+    assert np.allclose(batch.column("h2densities"), 0.5 * batch.densities)
+    assert np.allclose(batch.column("abundances"), 2e-3 * 2.01588 / 28.0101)
+    dopplerWidths = batch.column("dopplerwidths")
+    assert np.all(dopplerWidths[:512] == 0)
+    assert np.allclose(dopplerWidths[512:], np.sqrt(2 * np.var(np.arange(8))))
+    assert batch.column("magfluxes") is None
+
+
+def memmapTest():
+    """contiguous datasets are memory mapped, chunked ones stay h5py datasets"""
+    testDir = pathlib.Path(__file__).parent.absolute() / "tests"
+    outFile = testDir.joinpath("out/memmap_test.h5")
+    values = np.arange(2 * 8**3, dtype=">f4").reshape(2, 8, 8, 8)
+    with h5py.File(str(outFile), "w", userblock_size=512) as h5File:
+        h5File.create_dataset("contiguous", data=values)
+        h5File.create_dataset("gzip", data=values, compression="gzip")
+
+    with h5py.File(str(outFile), "r") as h5File:
+        mapped = memmapForDataset(h5File["contiguous"])
+        assert isinstance(mapped, np.memmap)
+        assert np.array_equal(mapped[1:], values[1:])
+        assert isinstance(memmapForDataset(h5File["gzip"]), h5py.Dataset)
+
+
+def ioLimitMemmapTest():
+    """batches of memory mapped FLASH files must be read while holding an I/O
+    slot, no values may be left mapped for reading after it is released"""
+    testDir = pathlib.Path(__file__).parent.absolute() / "tests"
+    flashFile = testDir.joinpath("out/io_limit_memmap_test_flash.h5")
+    writeSyntheticFlashFile(str(flashFile), 64, seed=3)
+
+    class RecordingSemaphore:
+        def __init__(self):
+            self.acquired = 0
+
+        def __enter__(self):
+            self.acquired += 1
+
+        def __exit__(self, *exception):
+            return False
+
+    semaphore = RecordingSemaphore()
+    with h5py.File(str(flashFile), "r") as h5File:
+        ff = FlashFactory(h5File)
+        assert isinstance(ff.densities, np.memmap)
+        # siblings without children, read as a single slice
+        first = np.flatnonzero(ff.leaves[7:] - ff.leaves[:-7] == 7)[0]
+        blockIds = ff.leaves[first : first + 8]
+        setIoSemaphore(semaphore)
+        try:
+            values = ff.readBatch(blockIds)
+        finally:
+            setIoSemaphore(None)
+        densities = h5File["dens"][()][blockIds]
+
+    arrays = [*values[1:4], *values[4], *values[5], *values[6].values()]
+    assert semaphore.acquired == 1
+    assert not any(isinstance(array, np.memmap) for array in arrays)
+    assert np.array_equal(values[3], densities)
+
+
+def scalingModelTest():
+    """JobModel of the scheduler must estimate the run times ScalingModel of
+    analyze/limeScaling.py was fitted to"""
+    scalingPath = pathlib.Path(__file__).parent.parent / "analyze/limeScaling.py"
+    spec = importlib.util.spec_from_file_location("limeScaling", scalingPath)
+    limeScaling = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(limeScaling)
+
+    parameters = {"overhead": 3.0, "serialT": 0.02, "parallelT": 0.5}
+    scalingModel = limeScaling.ScalingModel(**parameters, pointsPerBlock=512)
+    jobModel = JobModel(**scalingModel.toDict())
+    for nBlocks, nThreads in [(1, 1), (64, 4), (1000, 16)]:
+        assert np.isclose(
+            jobModel.time(nBlocks * 512, nThreads),
+            scalingModel.time(nBlocks, nThreads),
+        )
+
+
+def assertSameColumns(limeFilePath, otherLimeFilePath):
+    with h5py.File(str(limeFilePath), "r") as limeFile, h5py.File(
+        str(otherLimeFilePath), "r"
+    ) as otherLimeFile:
+        columns = limeFile["GRID/columns"]
+        otherColumns = otherLimeFile["GRID/columns"]
+        assert sorted(columns) == sorted(otherColumns)
+        for name in columns:
+            assert columns[name].dtype == otherColumns[name].dtype, name
+            assert np.array_equal(columns[name][()], otherColumns[name][()]), name
+
+
+def resumeTest():
+    """a conversion interrupted after some blocks and continued with --resume
+    must equal an uninterrupted one"""
+    testDir = pathlib.Path(__file__).parent.absolute() / "tests"
+    flashFile = testDir.joinpath("out/resume_test_flash.h5")
+    fullFile = testDir.joinpath("out/resume_test_full.h5")
+    resumedFile = testDir.joinpath("out/resume_test_resumed.h5")
+    nLeaves = writeSyntheticFlashFile(str(flashFile), 200, seed=1)
+    parser = createArgumentParser()
+    # without a write buffer, progress is recorded after every batch
+    arguments = ["-s", "100", "--sinkseed", "1", "--batchsize", "8"]
+    arguments += ["--buffersize", "0"]
+
+    convertWithArgs(parser.parse_args([str(flashFile), str(fullFile), *arguments]))
+
+    class Interrupted(Exception):
+        pass
+
+    recordProgress = LimeFile.recordProgress
+
+    def interruptedRecordProgress(self, blocksDone, pointsDone):
+        recordProgress(self, blocksDone, pointsDone)
+        if blocksDone >= nLeaves // 3:
+            raise Interrupted()
+
+    LimeFile.recordProgress = interruptedRecordProgress
+    try:
+        convertWithArgs(
+            parser.parse_args([str(flashFile), str(resumedFile), *arguments])
+        )
+    except Interrupted:
+        pass
+    finally:
+        LimeFile.recordProgress = recordProgress
+    assert 0 < progressForFile(resumedFile)["BLOCKS_DONE"] < nLeaves
+
+    convertWithArgs(
+        parser.parse_args([str(flashFile), str(resumedFile), *arguments, "--resume"])
+    )
+    assertSameColumns(fullFile, resumedFile)
+
+
+def readModesTest():
+    """--workers, --shards and --prefetch must write the same columns as a
+    serial conversion"""
+    testDir = pathlib.Path(__file__).parent.absolute() / "tests"
+    flashFile = testDir.joinpath("out/read_modes_test_flash.h5")
+    writeSyntheticFlashFile(str(flashFile), 200, seed=2)
+    parser = createArgumentParser()
+    arguments = ["-s", "100", "--sinkseed", "1", "--batchsize", "16"]
+
+    serialFile = testDir.joinpath("out/read_modes_test_serial.h5")
+    convertWithArgs(parser.parse_args([str(flashFile), str(serialFile), *arguments]))
+    for name, modeArguments in [
+        ("workers", ["--workers", "3"]),
+        ("shards", ["--workers", "3", "--shards"]),
+        ("prefetch", ["--prefetch", "2"]),
+    ]:
+        outFile = testDir.joinpath(f"out/read_modes_test_{name}.h5")
+        convertWithArgs(
+            parser.parse_args(
+                [str(flashFile), str(outFile), *arguments, *modeArguments]
+            )
+        )
+        assertSameColumns(serialFile, outFile)
+
+
 def suzanneTest():
     class DummyBlock:
         def __init__(self):
@@ -198,4 +446,12 @@ if __name__ == "__main__":
     # singleBlockTest()
     # allBlocksTest()
     # threeBlocksTest()
+    # constantMemoryColumnsTest()
+    # limeSchedulerTest()
+    # scalingModelTest()
+    # resumeTest()
+    # readModesTest()
+    # derivedFieldsTest()
+    # memmapTest()
+    # ioLimitMemmapTest()
     executionTimeTest()